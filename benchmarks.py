@@ -0,0 +1,319 @@
+"""Benchmarks for the hdf5generator entry points.
+
+Synthetic corpora are generated in a temporary directory: many small
+text files, large images and a deep ISA group tree with wide attribute
+sets. Every entry point is timed at several scales in a fresh process,
+so the peak RSS is measured per benchmark. The results are written as
+JSON and can be compared with an earlier run.
+
+Usage:
+    python benchmarks.py --scales 1,4 --output results.json
+    python benchmarks.py --compare results.json
+"""
+from PIL import Image
+
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import random
+import tempfile
+import platform
+import contextlib
+import resource
+import multiprocessing
+import numpy as np
+import h5py
+import hdf5generator
+
+TEXT_FILES = 200
+TEXT_SIZE = 2048
+IMAGE_SIZE = 2048
+TREE_INVESTIGATIONS = 2
+TREE_STUDIES = 3
+TREE_ASSAYS = 4
+TREE_ATTRIBUTES = 100
+WIDE_ATTRIBUTES = 300
+REGRESSION_THRESHOLD = 1.2
+
+
+def make_corpus(root, scale):
+    """Generate the synthetic input files of one scale.
+
+    Arguments:
+        root: Directory for the input files.
+        scale: Multiplier for the number of files.
+
+    Returns:
+        Dictionary with the text files, image files and ISA tree rows.
+    """
+    rng = random.Random(scale)
+    letters = 'ACGT'
+    os.makedirs(root, exist_ok=True)
+    text = []
+    for i in range(TEXT_FILES * scale):
+        path = os.path.join(root, 'seq{}.fasta'.format(i))
+        with open(path, 'w') as seqfile:
+            seqfile.write('>seq{}\n'.format(i))
+            seqfile.write(''.join(rng.choice(letters) for _ in range(TEXT_SIZE)))
+            seqfile.write('\n')
+        text.append(path)
+    images = []
+    for i in range(scale):
+        y, x = np.mgrid[0:IMAGE_SIZE, 0:IMAGE_SIZE]
+        noise = np.random.default_rng(i).integers(0, 32, (IMAGE_SIZE, IMAGE_SIZE, 3))
+        pixels = (np.dstack([x % 256, y % 256, (x + y) % 256]) + noise) % 256
+        path = os.path.join(root, 'image{}.png'.format(i))
+        Image.fromarray(pixels.astype(np.uint8)).save(path)
+        images.append(path)
+    tree = []
+    for i in range(TREE_INVESTIGATIONS):
+        for s in range(TREE_STUDIES):
+            for a in range(TREE_ASSAYS * scale):
+                path = text[(i * 100 + s * 10 + a) % len(text)]
+                group = '/Project/Investigation{}/Study{}/Assay{}/'.format(i, s, a)
+                width = WIDE_ATTRIBUTES if a % 4 == 0 else TREE_ATTRIBUTES
+                attributes = {
+                    'Attribute{}'.format(k): [str(rng.randint(0, 10 ** 6))]
+                    for k in range(width)
+                }
+                attributes['Date'] = ['2020-01-{:02d}'.format(a % 28 + 1)]
+                tree.append((path, group, attributes))
+    return {'text': text, 'images': images, 'tree': tree}
+
+
+def bench_ingest_text(corpus, workdir):
+    """Ingest many small text files into one group."""
+    hdf5generator.write_func(
+        corpus['text'], 'text.h5', ['/Project/Investigation/Study/Assay/'],
+        attributes=[{} for _ in corpus['text']])
+    return len(corpus['text']), _input_bytes(corpus['text']), 'text.h5'
+
+
+def bench_ingest_images(corpus, workdir):
+    """Ingest large images."""
+    hdf5generator.write_func(
+        corpus['images'], 'images.h5', ['/Project/Investigation/Study/Assay/'],
+        attributes=[{} for _ in corpus['images']])
+    return len(corpus['images']), _input_bytes(corpus['images']), 'images.h5'
+
+
+def bench_ingest_tree(corpus, workdir):
+    """Ingest files into a deep ISA tree with wide attribute sets."""
+    paths = [path for path, group, attributes in corpus['tree']]
+    hdf5generator.write_func(
+        paths, 'tree.h5', [group for path, group, attributes in corpus['tree']],
+        attributes=[attributes for path, group, attributes in corpus['tree']])
+    return len(paths), _input_bytes(paths), 'tree.h5'
+
+
+def bench_find_datasets(corpus, workdir):
+    """Extract the images with h5py visititems and find_datasets."""
+    hdf_file = os.path.join(workdir, 'ingest_images', 'images.h5')
+    with h5py.File(hdf_file, 'r') as f:
+        f.visititems(hdf5generator.find_datasets)
+    return len(corpus['images']), os.path.getsize(hdf_file), hdf_file
+
+
+def bench_extract_datasets(corpus, workdir):
+    """Extract the small text files with extract_datasets."""
+    hdf_file = os.path.join(workdir, 'ingest_text', 'text.h5')
+    count = hdf5generator.extract_datasets(hdf_file)
+    return count, _input_bytes(corpus['text']), hdf_file
+
+
+def bench_get_attr(corpus, workdir):
+    """Print the attributes of the ISA tree without a cached catalog."""
+    hdf_file = os.path.join(workdir, 'ingest_tree', 'tree.h5')
+    if os.path.exists(hdf_file + '.catalog.json'):
+        os.remove(hdf_file + '.catalog.json')
+    hdf5generator.get_attr(hdf_file)
+    return len(corpus['tree']), os.path.getsize(hdf_file), hdf_file
+
+
+def bench_generate_rdf(corpus, workdir):
+    """Generate the RDF of the ISA tree from scratch."""
+    hdf_file = os.path.join(workdir, 'ingest_tree', 'tree.h5')
+    hdf5generator.generate_rdf(hdf_file, incremental=False)
+    rdf_file = hdf_file.split('/')[-1] + '.rdf'
+    return len(corpus['tree']), os.path.getsize(hdf_file), rdf_file
+
+
+BENCHMARKS = [
+    ('ingest_text', bench_ingest_text),
+    ('ingest_images', bench_ingest_images),
+    ('ingest_tree', bench_ingest_tree),
+    ('find_datasets', bench_find_datasets),
+    ('extract_datasets', bench_extract_datasets),
+    ('get_attr', bench_get_attr),
+    ('generate_rdf', bench_generate_rdf),
+]
+
+
+def _input_bytes(paths):
+    """Total size of the input files in bytes."""
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes.
+    Linux keeps ru_maxrss of the parent after exec, so VmHWM is used there.
+
+    Returns:
+        The peak RSS in bytes.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _run_benchmark(name, corpus, workdir, conn):
+    """Run a single benchmark in a fresh process and send the result.
+
+    Arguments:
+        name: Name of the benchmark.
+        corpus: Corpus from make_corpus.
+        workdir: Directory with a working directory per benchmark.
+        conn: Pipe connection for the result.
+    """
+    func = dict(BENCHMARKS)[name]
+    os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    os.chdir(os.path.join(workdir, name))
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        items, nbytes, out_file = func(corpus, workdir)
+        seconds = time.perf_counter() - start
+    conn.send({
+        'seconds': seconds,
+        'items': items,
+        'bytes': nbytes,
+        'items_per_second': items / seconds,
+        'mb_per_second': nbytes / 1e6 / seconds,
+        'peak_rss': peak_rss(),
+        'file_size': os.path.getsize(out_file),
+    })
+    conn.close()
+
+
+def run(scales, names=None, keep=False):
+    """Run the benchmarks at several scales.
+
+    Arguments:
+        scales: List of scales, see make_corpus.
+
+    Keyword Arguments:
+        names: Names of the benchmarks to run, None runs all benchmarks.
+        Ingest benchmarks create the files the other benchmarks read.
+        (default: {None})
+        keep: Keep the temporary directory. (default: {False})
+
+    Returns:
+        Dictionary with the environment and the results by benchmark
+        and scale.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {
+        'python': platform.python_version(),
+        'h5py': h5py.__version__,
+        'hdf5': h5py.version.hdf5_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': {},
+    }
+    tmp = tempfile.mkdtemp(prefix='hdf5generator-bench-')
+    try:
+        for scale in scales:
+            workdir = os.path.join(tmp, 'scale{}'.format(scale))
+            corpus = make_corpus(os.path.join(workdir, 'input'), scale)
+            for name, _ in BENCHMARKS:
+                if names and name not in names and not name.startswith('ingest'):
+                    continue
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_run_benchmark, args=(name, corpus, workdir, sender))
+                process.start()
+                sender.close()
+                result = receiver.recv()
+                process.join()
+                results['results'].setdefault(name, {})[str(scale)] = result
+                print("{:<18} scale {:<3} {:>8.3f}s {:>10.1f} items/s {:>8.1f} MB/s "
+                      "{:>8.1f} MB RSS {:>8.1f} MB file".format(
+                          name, scale, result['seconds'],
+                          result['items_per_second'], result['mb_per_second'],
+                          result['peak_rss'] / 1e6, result['file_size'] / 1e6))
+    finally:
+        if keep:
+            print("Benchmark files kept in", tmp)
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """Print the benchmarks that became slower than the threshold.
+
+    Arguments:
+        old: Results of an earlier run.
+        new: Results of this run.
+
+    Keyword Arguments:
+        threshold: Ratio of the new and old time that counts as a
+        regression. (default: {REGRESSION_THRESHOLD})
+
+    Returns:
+        List of (benchmark, scale, ratio) tuples of the regressions.
+    """
+    regressions = []
+    for name, scales in new['results'].items():
+        for scale, result in scales.items():
+            before = old['results'].get(name, {}).get(scale)
+            if before is None:
+                continue
+            ratio = result['seconds'] / before['seconds']
+            print("{:<18} scale {:<3} {:>6.2f}x time {:>6.2f}x RSS {:>6.2f}x file".format(
+                name, scale, ratio, result['peak_rss'] / before['peak_rss'],
+                result['file_size'] / before['file_size']))
+            if ratio > threshold:
+                regressions.append((name, scale, ratio))
+    for name, scale, ratio in regressions:
+        print("Regression:", name, "scale", scale, "is {:.2f}x slower".format(ratio))
+    return regressions
+
+
+def get_option(option, default=None):
+    """Get the value that follows an optional command line argument."""
+    if option in sys.argv[1:-1]:
+        return sys.argv[sys.argv.index(option) + 1]
+    return default
+
+
+if __name__ == "__main__":
+    if "--help" in sys.argv:
+        print(__doc__)
+        print("Options: --scales <1,4,...> --output <JSON path> --compare <JSON path> "
+              "--threshold <ratio> --only <benchmark,...> --keep")
+        print("Benchmarks:", ', '.join(name for name, _ in BENCHMARKS))
+        sys.exit()
+    scales = [int(s) for s in get_option("--scales", "1,4").split(',')]
+    only = get_option("--only")
+    results = run(scales, names=None if only is None else only.split(','),
+                  keep="--keep" in sys.argv)
+    output = get_option("--output", "benchmark-results.json")
+    with open(output, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    print("Results written to", output)
+    previous = get_option("--compare")
+    if previous is not None:
+        with open(previous) as prevfile:
+            regressions = compare(
+                json.load(prevfile), results,
+                float(get_option("--threshold", REGRESSION_THRESHOLD)))
+        sys.exit(1 if regressions else 0)
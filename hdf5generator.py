@@ -1,19 +1,254 @@
-from h5py import Dataset
-from PIL import Image
-from rdflib import Graph, URIRef, BNode, Literal, Namespace
-from rdflib.namespace import FOAF, RDF
-from subprocess import call
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import sys
-import h5py
-import numpy as np
 import os
-import ols_client
 import uuid
 import os.path
-import requests
 import json
 import datetime
+import time
+import zlib
+import hashlib
+import gzip
+import pathlib
+import sqlite3
+import asyncio
+import threading
+import functools
+import types
+import collections
+import fnmatch
+import bisect
+import contextlib
+import cProfile
+import argparse
+import shlex
+import socket
+import socketserver
+import base64
+import importlib.util
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _lazy_import(name):
+    """Import a module on first attribute access with
+    importlib.util.LazyLoader, so commands that do not need
+    a heavy dependency do not pay for importing it.
+
+    Arguments:
+        name: Name of the module.
+
+    Returns:
+        The module, it is loaded when one of its attributes is used.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+h5py = _lazy_import('h5py')
+np = _lazy_import('numpy')
+requests = _lazy_import('requests')
+rdflib = _lazy_import('rdflib')
+Image = _lazy_import('PIL.Image')
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'bmp', 'tiff']
+TEXT_BLOCK_SIZE = 1 << 20
+RESERVED_GROUP = '.hdf5generator'
+OFFSETS_GROUP = '/' + RESERVED_GROUP + '/offsets'
+ATTRIBUTES_GROUP = '/' + RESERVED_GROUP + '/attributes'
+CONTENT_GROUP = '/' + RESERVED_GROUP + '/content'
+SOURCES_TABLE = '/' + RESERVED_GROUP + '/sources'
+PYRAMIDS_GROUP = '/' + RESERVED_GROUP + '/pyramids'
+PYRAMID_TILE = 256
+CHUNK_CACHE_SIZE = 64 << 20
+PREFETCH_CHUNKS = 4
+PREVIEW_SIZE = 1000
+PROVENANCE_PREFIX = 'hdf5generator:'
+CHECKSUM_ATTRIBUTE = PROVENANCE_PREFIX + 'checksum'
+CHECKSUM_BLOCK = 16 << 20
+VERIFY_TASK_BLOCKS = 4
+CONTENT_COMPANIONS = [(OFFSETS_GROUP, '.offsets'), (PYRAMIDS_GROUP, '.pyramid')]
+ATTRIBUTE_TABLE_THRESHOLD = 256
+ATTRIBUTE_TABLE = '.table'
+LIBVER = ('v108', 'latest')
+FS_STRATEGY = 'fsm'
+METADATA_CACHE_SIZE = 256
+OLS_URL = os.environ.get(
+    'HDF5GENERATOR_OLS_URL', 'https://www.ebi.ac.uk/ols4/api/search')
+NATURALIS_URL = os.environ.get(
+    'HDF5GENERATOR_NATURALIS_URL',
+    'https://api.biodiversitydata.nl/v2/specimen/find/')
+LOOKUP_CACHE = os.environ.get(
+    'HDF5GENERATOR_LOOKUP_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'hdf5generator', 'lookups.sqlite'))
+LOOKUP_TTL = 30 * 24 * 60 * 60
+COMMANDS = [
+    'create_group', 'create_hdf', 'get_datasets', 'get_attributes',
+    'delete_groups', 'repack', 'create_rdf', 'search_rdf', 'batch', 'serve',
+    'verify'
+]
+BATCH_END = '--end--'
+POOL_SIZE = 8
+POOL_IDLE = 2.0
+LATENCY_SAMPLES = 10000
+LOOPBACK_HOSTS = ['localhost', '127.0.0.1', '::1']
+
+_catalogs = {}
+_profiler = None
+
+
+class Profiler:
+    """Collect the calls, wall time, bytes and peak memory per stage.
+    A stage is a profiled function or a profile_stage block, the time
+    of a stage includes the stages it calls. Only the stages of this
+    process are recorded, not those of worker processes.
+
+    Keyword Arguments:
+        stats_file: Also run cProfile and dump the pstats to this file.
+        (default: {None})
+    """
+
+    def __init__(self, stats_file=None):
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stats_file = stats_file
+        self.cprofile = None
+        if stats_file is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record the wall time of a block as a call of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds=0.0, calls=1, nbytes=0):
+        """Add calls, seconds and bytes to a stage."""
+        with self.lock:
+            stats = self.stages.setdefault(
+                name, {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'peak_rss': 0})
+            stats['calls'] += calls
+            stats['seconds'] += seconds
+            stats['bytes'] += nbytes
+            stats['peak_rss'] = max(stats['peak_rss'], peak_rss())
+
+    def report(self):
+        """Return the recorded stages as a dictionary."""
+        return {
+            'wall': time.perf_counter() - self.start,
+            'peak_rss': peak_rss(),
+            'stages': self.stages
+        }
+
+    def stop(self, table=True, json_file=None):
+        """Stop profiling, print the summary table and write the
+        JSON report and the pstats file.
+
+        Keyword Arguments:
+            table: Print the summary table. (default: {True})
+            json_file: Write the report as JSON to this file. (default: {None})
+
+        Returns:
+            The report, see report.
+        """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.stats_file)
+            print("Profile statistics written to", self.stats_file)
+        report = self.report()
+        if table:
+            print()
+            print("{:<28} {:>8} {:>10} {:>7} {:>10} {:>12}".format(
+                "Stage", "Calls", "Seconds", "%", "MB", "Peak RSS MB"))
+            for name, stats in sorted(
+                    report['stages'].items(), key=lambda item: -item[1]['seconds']):
+                print("{:<28} {:>8} {:>10.3f} {:>7.1f} {:>10.1f} {:>12.1f}".format(
+                    name, stats['calls'], stats['seconds'],
+                    100 * stats['seconds'] / max(report['wall'], 1e-9),
+                    stats['bytes'] / 1e6, stats['peak_rss'] / 1e6))
+            print("Wall time {:.3f}s, peak RSS {:.1f} MB".format(
+                report['wall'], report['peak_rss'] / 1e6))
+        if json_file is not None:
+            with open(json_file, 'w') as jsonfile:
+                json.dump(report, jsonfile, indent=2)
+        return report
+
+
+def start_profiling(stats_file=None):
+    """Enable the profiled functions until stop_profiling is called.
+
+    Keyword Arguments:
+        stats_file: Dump cProfile statistics to this file. (default: {None})
+
+    Returns:
+        The active Profiler.
+    """
+    global _profiler
+    _profiler = Profiler(stats_file)
+    return _profiler
+
+
+def stop_profiling(table=True, json_file=None):
+    """Disable profiling and report, see Profiler.stop.
+
+    Returns:
+        The report or None when profiling was not enabled.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    return profiler.stop(table, json_file)
+
+
+def profiled(func):
+    """Decorator that records the calls and wall time of a function
+    as a stage while profiling is enabled."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        with _profiler.stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def profile_stage(name):
+    """Context manager that records a block as a stage while
+    profiling is enabled."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+
+def profile_bytes(name, nbytes):
+    """Add the bytes read or written to a stage while profiling is enabled."""
+    if _profiler is not None:
+        _profiler.record(name, calls=0, nbytes=nbytes)
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, 0 when unknown."""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
 
 
 def write_groups(out_file, groupname):
@@ -31,27 +266,20 @@ def write_groups(out_file, groupname):
     meta = input("Is there a metadata file? (Y/N): ")
     if meta == "Y" or meta == "y":
         metapath = input("Enter metadata file path: ")
-        with open(metapath, 'r') as metafile:
-            for line in metafile:
-                line = line.split('\t')
-                item = line[0].strip('\n')
-                value = line[-1].strip('\n')
-                if item in attributes.keys():
-                    attributes[item].append(value)
-                else:
-                    attributes[item] = [value]
+        attributes = read_metadata_file(metapath)
     else:
         input_attributes = input("Enter an attribute followed by a value. i.e. Project Name: iknowit, Date: 04-11-2019: ")
         for attribute in input_attributes.split(','):
             attribute = attribute.split(':')
             attributes[attribute[0].strip(' ')] = attribute[1].strip(' ')
-    data_file = h5py.File(out_file, 'a')
-    dset = data_file.create_group(groupname)
-    for k, v in attributes.items():
-        dset.attrs[k] = v
+    with open_hdf(out_file) as data_file:
+        dset = data_file.create_group(groupname)
+        write_attributes(dset, attributes)
 
 
-def write_func(in_files, out_file, groups):
+@profiled
+def write_func(in_files, out_file, groups, attributes=None, stream=False,
+               dedup=False, sync=None, pyramid=False):
     """Write the HDF5 file based on the input files, 
     group names and attributes.
 
@@ -62,543 +290,3774 @@ def write_func(in_files, out_file, groups):
         out_file: HDF5 output file.
         groups: The group structure.
 
+    Keyword Arguments:
+        attributes: List with a dictionary of attributes per input file.
+        None asks for the attributes of every dataset. (default: {None})
+        stream: Copy text files in blocks into a compressed byte dataset
+        instead of a single string. Use 'line' or 'fasta' to also build
+        a record index, see text_to_hdf5. (default: {False})
+        dedup: Store identical input files once, see _ingest_file.
+        (default: {False})
+        sync: Only add input files that are new or changed since they
+        were added, see sync_jobs. (default: {None})
+        pyramid: Store downsampled levels of images, see image_to_hdf5.
+        (default: {False})
+
     Raises:
         FileNotFoundError: The entered file does not exist.
         RuntimeError: An error occured while generating the HDF5 file.
     """
-    data_file = h5py.File(out_file, 'a')
-    image_extensions = ['jpg', 'jpeg', 'png', 'bmp', 'tiff']
-    count = 0
-    try:
-        for in_file in in_files:
-            if in_file.split('.')[-1] not in image_extensions:
-                try:
-                    with open(in_file) as ocf:
-                        data = ocf.read()
-                    str_type = h5py.special_dtype(vlen=str)
-                    dset = data_file.create_dataset(
-                        groups[count] + in_file.split('/')[-1],
-                        data=data, shape=(1,),
-                        dtype=str_type
-                    )
-                    attributes = generate_attributes_to_add(
-                        groups[count] + in_file.split('/')[-1])
-                    for k, v in attributes.items():
-                        dset.attrs[k] = v
-                except FileNotFoundError:
-                    print(in_file, "not found")
-            else:
-                dset = image_to_hdf5(in_file, data_file, groups[count])
-                attributes = generate_attributes_to_add(
-                    groups[count] + in_file.split('/')[-1])
-                for k, v in attributes.items():
-                    dset.attrs[k] = v
-            if len(groups) == 1:
-                count = 0
-            else:
-                count += 1
-    except RuntimeError:
-        pass
+    jobs = (
+        (in_file, groups[0 if len(groups) == 1 else count] + in_file.split('/')[-1],
+         None if attributes is None else attributes[count])
+        for count, in_file in enumerate(in_files)
+    )
+    with open_hdf(out_file) as data_file:
+        sources = read_sources(data_file)
+        try:
+            for in_file, name, attrs, state in sync_jobs(data_file, jobs, sources, sync):
+                if attrs is None:
+                    attrs = generate_attributes_to_add(name)
+                dset = _ingest_file(data_file, in_file, name.rsplit('/', 1)[0] + '/',
+                                    stream, dedup, pyramid, attrs, state['hash'])
+                if dset is not None:
+                    write_attributes(dset, attrs)
+                    write_provenance(dset, state)
+                    sources[name] = state
+        except RuntimeError:
+            pass
+        finally:
+            write_sources(data_file, sources)
 
 
-def generate_attributes_to_add(group_name):
-    """ Search ontology lookup service and create a list of attributes 
-    to add to a dataset. At the moment the information stored from OLS
-    is the name, iri and description.
+@profiled
+def _ingest_file(data_file, in_file, group, stream=False, dedup=False,
+                 pyramid=False, attributes=None, digest=None):
+    """Add a single input file as a dataset to the HDF5 file.
 
     Arguments:
-        group_name: The name of the group in which the dataset is located.
+        data_file: Opened HDF5 file.
+        in_file: Input file to add to the HDF5 file.
+        group: HDF5 group name.
+
+    Keyword Arguments:
+        stream: Store text files with text_to_hdf5. (default: {False})
+        dedup: When the same input file with the same attributes is already
+        stored, the dataset is a hard link to it instead of a copy, see
+        content_key. (default: {False})
+        pyramid: Store downsampled levels of images. (default: {False})
+        attributes: Attributes the dataset will get, part of the
+        deduplication key. (default: {None})
+        digest: Digest of the input file when it is already known, see
+        file_digest. (default: {None})
 
     Returns:
-        Dictionary of attributes. Key is the name and 
-        the values are the description and iri.
+        The created HDF5 dataset or None when the file does not exist.
     """
-    attributes = dict()
-    print("Enter attributes for " + group_name)
-    meta = input("Is there a metadata file? (Y/N): ")
-    if meta == "Y" or meta == "y":
-        metapath = input("Enter metadata file path: ")
-        with open(metapath, 'r') as metafile:
-            for line in metafile:
-                line = line.split('\t')
-                item = line[0].strip('\n')
-                value = line[-1].strip('\n')
-                if item in attributes.keys():
-                    attributes[item].append(value)
-                else:
-                    attributes[item] = [value]
-    else:
-        while True:
-            print()
-            print("Enter attributes for " + group_name)
-            ontosearching = input("Search ontologies? Y/N: ")
-            if ontosearching == "Y" or ontosearching == "y":
-                print("Please enter the attribute name and search term")
-                print("i.e. Format fasta")
-                attr = input("")
-                attr_name = attr.split(' ')[0]
-                ontolist = ontologies(attr.split(' ')[1])
-                print("ID -- Name -- Description -- IRI")
-                print()
-                for onto in enumerate(ontolist):
-                    print(onto[0], "--", onto[1][0], "--",
-                        onto[1][1], "--", onto[1][2])
-                select_onto = input(
-                    "Select an ontology description(s) to add (comma seperated): ")
-                if select_onto == '':
-                    pass
-                else:
-                    for select in select_onto.split(','):
-                        added_onto = ontolist[int(select)]
-                        attributes[attr_name + "Description"] = [added_onto[1]]
-                        attributes[attr_name + "IRI"] = [added_onto[2]]
-            else:
-                naturalis_term = input("Add a Naturalis specimen ID: ")
-                naturalis = search_naturalis(naturalis_term)
-                for nitem, nvalue in naturalis.items():
-                    attributes[nitem] = [nvalue]
-            continue_attr = input("Add another attribute? (Y/N): ")
-            if continue_attr == "y" or continue_attr == "Y":
-                True
-            else:
-                break
-    return attributes
+    if dedup:
+        try:
+            key = content_key(digest or file_digest(in_file), in_file, stream,
+                              attributes)
+        except FileNotFoundError:
+            print(in_file, "not found")
+            return None
+        dset = _link_content(data_file, key, group + in_file.split('/')[-1])
+        if dset is not None:
+            return dset
+    dset = _create_dataset(data_file, in_file, group, stream, pyramid)
+    if dedup and dset is not None:
+        _index_content(data_file, key, dset)
+    return dset
 
 
-def generate_groups_to_delete():
-    """Enter the groups to delete and 
-    return a list of groups to remove from the HDF5 file.
+def _create_dataset(data_file, in_file, group, stream=False, pyramid=False):
+    """Create the dataset of an input file, see _ingest_file.
 
     Returns:
-        A list with all entered groups to delete from the HDF5 file.
+        The created HDF5 dataset or None when the file does not exist.
     """
-    groups_to_delete = []
-    while True:
-        datasetname = input("Enter dataset name to delete: ")
-        groups_to_delete.append(datasetname)
-        continue_del = input("Add another dataset to delete? (Y/N): ")
-        if continue_del == "y" or continue_del == "Y":
-            True
-        else:
-            break
-    return groups_to_delete
-
+    if in_file.split('.')[-1] not in IMAGE_EXTENSIONS:
+        try:
+            if stream:
+                return text_to_hdf5(in_file, data_file, group,
+                                    index=None if stream is True else stream)
+            with open(in_file) as ocf:
+                data = ocf.read()
+        except FileNotFoundError:
+            print(in_file, "not found")
+            return None
+        str_type = h5py.special_dtype(vlen=str)
+        dset = data_file.create_dataset(
+            group + in_file.split('/')[-1],
+            data=data, shape=(1,), dtype=str_type
+        )
+        digest = BlockDigest()
+        digest.update(data.encode('utf-8'))
+        dset.attrs[CHECKSUM_ATTRIBUTE] = digest.hexdigest()
+        return dset
+    return image_to_hdf5(in_file, data_file, group, pyramid=pyramid)
 
-def find_datasets(name, node):
-    """Read the nodes from the h5py visititems function
-    and check if the node is a dataset.
 
-    TODO: See if this works with different array types.
-    FIXME: Add option for different array types.
+@profiled
+def write_manifest(manifest, out_file, workers=None, queue_size=None,
+                   stream=False, dedup=False, sync=None, pyramid=False):
+    """Write the HDF5 file based on a manifest without asking for input.
+    The manifest is read row by row so it can be of any size.
 
     Arguments:
-        name: Name from h5py visititems.
-        node: The group node from h5py visititems.
+        manifest: TSV or JSON Lines manifest, see read_manifest.
+        out_file: HDF5 output file.
+
+    Keyword Arguments:
+        workers: Number of worker processes. None writes the files
+        in this process, 0 uses all CPUs. (default: {None})
+        queue_size: Maximum number of decoded files waiting to be written.
+        (default: {None})
+        stream: Store text files with text_to_hdf5. (default: {False})
+        dedup: Store identical input files once. (default: {False})
+        sync: Only add new or changed input files, see sync_jobs.
+        (default: {None})
+        pyramid: Store downsampled levels of images. (default: {False})
     """
-    if isinstance(node, h5py.Dataset):
-        dataset = node[:][0]
-        write_dataset(dataset, name.split('/')[-2], name.split('/')[-1])
-    else:
-        pass
+    jobs = (
+        (in_file, group + in_file.split('/')[-1], attributes)
+        for in_file, group, attributes in read_manifest(manifest)
+    )
+    if workers is not None:
+        _write_jobs(out_file, jobs, workers or None, queue_size,
+                    stream=stream, dedup=dedup, sync=sync, pyramid=pyramid)
+        return
+    with open_hdf(out_file) as data_file:
+        sources = read_sources(data_file)
+        try:
+            for in_file, name, attributes, state in sync_jobs(
+                    data_file, jobs, sources, sync):
+                dset = _ingest_file(data_file, in_file, name.rsplit('/', 1)[0] + '/',
+                                    stream, dedup, pyramid, attributes, state['hash'])
+                if dset is not None:
+                    write_attributes(dset, attributes)
+                    write_provenance(dset, state)
+                    sources[name] = state
+        finally:
+            write_sources(data_file, sources)
 
 
-def get_groups(name):
-    """Get the ISA structure based on the HDF5 group name.
+def read_manifest(manifest):
+    """Read an ingestion manifest one row at a time.
 
-    TODO: Return ISA structure with group names.
-    TODO: Find out want we want with this functionality.
+    A TSV manifest starts with a header line that contains the columns
+    path and group. The optional column metadata points to a metadata
+    file, every other column is added as an attribute.
+    A JSON Lines manifest (.jsonl or .ndjson) holds one object per line
+    with the keys path, group and optionally metadata and attributes.
 
     Arguments:
-        name: The name of the HDF5 group.
-    """
-    groups = {}
-    isa_structure = ["Project", "Investigation", "Study", "Assay"]
-    groupname = name.split('/')[-1]
-    groups[isa_structure[len(name.split('/'))-1]] = groupname
-
-
-def write_dataset(dataset, folder, out_file):
-    """Create files based on the available datasets in the HDF5 file.
+        manifest: Path of the manifest file.
 
-    Arguments:
-        dataset: Dataset from the HDF5 file.
-        folder: Directory to save the new dataset file.
-        out_file: Name of the new dataset file.
+    Returns:
+        Generator of (input file, group, attributes) tuples.
     """
-    if not os.path.isdir(folder):
-        os.makedirs(folder)
-    try:
-        with open(folder + '/' + out_file, 'w') as writefile:
-            writefile.write(dataset)
-    except TypeError:
-        im = Image.fromarray(dataset.astype('uint8'))
-        im.save(folder + '/' + out_file, "PNG")
+    with open(manifest, 'r') as manifestfile:
+        if manifest.split('.')[-1] in ['jsonl', 'ndjson']:
+            rows = (json.loads(line) for line in manifestfile if line.strip())
+        else:
+            header = manifestfile.readline().rstrip('\n').split('\t')
+            rows = (
+                dict(zip(header, line.rstrip('\n').split('\t')))
+                for line in manifestfile if line.strip()
+            )
+            rows = (
+                {
+                    'path': row.pop('path'),
+                    'group': row.pop('group'),
+                    'metadata': row.pop('metadata', ''),
+                    'attributes': {k: v for k, v in row.items() if v}
+                } for row in rows
+            )
+        for row in rows:
+            attributes = {}
+            if row.get('metadata'):
+                attributes = load_metadata_file(row['metadata'])
+            if row.get('attributes'):
+                attributes = dict(attributes)
+            for k, v in row.get('attributes', {}).items():
+                values = v if isinstance(v, list) else [v]
+                attributes[k] = list(attributes.get(k, [])) + [str(x) for x in values]
+            group = row['group'] if row['group'].endswith('/') else row['group'] + '/'
+            yield row['path'].replace('\\', '/'), group, attributes
 
 
-def h5py_dataset_iterator(fc, prefix=''):
-    """Iterate through file content and get the dataset paths in the HDF5 file.
+def read_metadata_file(metapath):
+    """Read a tab separated metadata file.
+    The first column is the attribute name and the last column the value.
 
     Arguments:
-        fc: HDF5 file content.
+        metapath: Path of the metadata file.
 
-    Keyword Arguments:
-        prefix: Group name prefix. 
-        The default is '' as there is no group available before first one.
-        (default: {''})
+    Returns:
+        Dictionary of attributes with a list of values per attribute.
     """
-    for key in fc.keys():
-        item = fc[key]
-        path = '{}/{}'.format(prefix, key)
-        if isinstance(item, h5py.Dataset):
-            yield (path, item)
-        elif isinstance(item, h5py.Group):
-            yield from h5py_dataset_iterator(item, path)
+    return {k: list(v) for k, v in load_metadata_file(metapath).items()}
 
 
-def get_attr(hdf_file):
-    """Print all attributes from input HDF5 file.
+@profiled
+def load_metadata_file(metapath):
+    """Read a tab separated metadata file, see read_metadata_file.
+    Every file is only parsed once as long as its modification time
+    and size do not change, the result is shared by all callers.
 
     Arguments:
-        hdf_file: HDF5 file to get the attributes from.
+        metapath: Path of the metadata file.
+
+    Returns:
+        Read-only mapping with a tuple of values per attribute.
     """
-    datasets = []
-    with h5py.File(hdf_file, 'r') as f:
-        for (path, dummydset) in h5py_dataset_iterator(f):
-            datasets.append(path)
-        for dataset in datasets:
-            print(dataset, "has the following attributes:")
-            all_attr = list(f[dataset].attrs)
-            for attr in all_attr:
-                for val in f[dataset].attrs.get(attr):
-                    attr_value = str(val)
-                    print(attr + ": " + attr_value)
-            print()
-            print()
+    stat = os.stat(metapath)
+    return _parse_metadata_file(
+        os.path.abspath(metapath), stat.st_mtime_ns, stat.st_size)
 
 
-def get_namespaces(g):
-    """Creates RDF namespaces and binds them to the graph.
-    
+@functools.lru_cache(maxsize=METADATA_CACHE_SIZE)
+def _parse_metadata_file(metapath, mtime, size):
+    """Parse a metadata file, see load_metadata_file.
+
     Arguments:
-        g: Triple store graph
+        metapath: Absolute path of the metadata file.
+        mtime: Modification time of the file, part of the cache key.
+        size: Size of the file, part of the cache key.
 
     Returns:
-        List with the used RDF namespaces.
+        Read-only mapping with a tuple of values per attribute.
     """
-    DCTERMS = Namespace('http://purl.org/dc/terms/')
-    HDF2RDF = Namespace("http://example.org/hdf2rdf/")
-    ISA = Namespace('http://purl.org/isaterms/')
-    VOID = Namespace('http://rdfs.org/ns/void#')
-    DCAT = Namespace('http://www.w3.org/ns/dcat#')
-    RDF = Namespace('http://www.w3.org/1999/02/22-rdf-syntax-ns#')
-    g.bind('dcterms', DCTERMS)
-    g.bind('hdf2rdf', HDF2RDF)
-    g.bind('isa', ISA)
-    g.bind('void', VOID)
-    g.bind('dcat', DCAT)
-    g.bind('rdf', RDF)
-    
-    return [DCTERMS, HDF2RDF, ISA, VOID, DCAT, RDF]
+    attributes = {}
+    with open(metapath, 'r') as metafile:
+        for line in metafile:
+            _add_metadata_line(attributes, line)
+    return types.MappingProxyType(
+        {k: tuple(v) for k, v in attributes.items()})
 
 
-def add_isa_triples(g, hdf_file, isa_title, isa_labels, isa_tab, count):
-    """Adds the ISA triples to the graph.
-    
+def _add_metadata_line(attributes, line):
+    """Add the attribute and value of a metadata file line.
+
     Arguments:
-        g: Triple store graph.
-        hdf_file: The HDF file.
-        isa_title: The ISA title.
-        Either the investigation, study or assay title)
-        isa_labels: The label that belongs to the title.
-        isa_tab: The ISA structure as a list.
-        count: Number that is linked to the ISA catalog.
+        attributes: Dictionary with a list of values per attribute.
+        line: Line of the metadata file.
     """
-    namespaces = get_namespaces(g)
-    if count == 1:
-        g.add(
-            (
-                URIRef(hdf_file + "#" + isa_title),
-                URIRef(namespaces[-1] + 'type'),
-                Literal(isa_labels.get(count))
-            )
-        )
-        g.add(
-            (
-                URIRef(hdf_file + "#" + isa_title),
-                URIRef(namespaces[0] + 'hasPart'),
-                Literal(hdf_file + "#" + isa_tab[count + 1])
-            )
-        )
-    else:
-        g.add(
-            (
-                URIRef(hdf_file + "#" + isa_title),
-                URIRef(namespaces[-1] + 'type'),
-                URIRef(namespaces[2] + isa_labels.get(count))
-            )
-        )
-        g.add(
-            (
-                URIRef(hdf_file + "#" + isa_title),
-                URIRef(namespaces[0] + 'isPartOf'),
-                Literal(hdf_file + "#" + isa_tab[count - 1])
-            )
-        )
-        try:
-            g.add(
-                (
-                    URIRef(hdf_file + "#" + isa_title),
-                    URIRef(namespaces[0] + 'hasPart'),
-                    Literal(hdf_file + "#" + isa_tab[count + 1])
-                )
-            )
-        except IndexError:
-            pass
+    line = line.split('\t')
+    item = line[0].strip('\n')
+    value = line[-1].strip('\n')
+    attributes.setdefault(item, []).append(value)
 
 
-def add_hdf_trples(g, hdf_file, dataset, catalog, isa_tab, identifier):
-    """Adds the triples to the graph based on the attributes in the HDF.
-    
+@profiled
+def write_attributes(obj, attributes, table_threshold=ATTRIBUTE_TABLE_THRESHOLD):
+    """Write all attributes of a group or dataset in one pass.
+
+    The type of every attribute is inferred from its values: 64-bit
+    integers and floats are stored as numbers and ISO 8601 dates (YYYY-MM-DD) as
+    fixed length strings. Other date notations are kept as entered.
+    Objects with more than table_threshold attributes get an attribute
+    table dataset instead, read them back with read_attributes.
+    Attributes starting with PROVENANCE_PREFIX are reserved for
+    write_provenance and the checksum and are skipped.
+
     Arguments:
-        g: Triple store graph
-        hdf_file: The HDF file.
-        dataset: The name of the dataset.
-        catalog: The complete HDF structure linked to the dataset.
-        isa_tab: The ISA structure as a list.
-        identifier {[type]} -- [description]
+        obj: HDF5 group or dataset.
+        attributes: Dictionary with a value or list of values per attribute.
+
+    Keyword Arguments:
+        table_threshold: Maximum number of attributes stored as
+        HDF5 attributes. (default: {ATTRIBUTE_TABLE_THRESHOLD})
     """
-    namespaces = get_namespaces(g)
-    g.add(
-        (
-            URIRef(hdf_file + "#" + dataset),
-            URIRef(namespaces[0] + 'isPartOf'),
-            Literal(catalog)
-        )
-    )
-    g.add(
-        (
-            URIRef(hdf_file + "#" + dataset),
-            URIRef(namespaces[-1] + 'type'),
-            URIRef(namespaces[4] + 'Dataset')
-        )
-    )
-    g.add(
-        (
-            URIRef(hdf_file + "#" + dataset),
-            URIRef(namespaces[4] + 'dataset'),
-            Literal(isa_tab[-1])
-        )
-    )
-    g.add(
-        (
-            URIRef(hdf_file + "#" + dataset),
-            URIRef(namespaces[4] + 'title'),
-            Literal(isa_tab[-1].split('.')[0])
-        )
-    )
-    g.add(
-        (
-            URIRef(hdf_file + "#" + dataset),
-            URIRef(namespaces[4] + 'identifier'),
-            Literal(identifier)
-        )
-    )
-    g.add(
-        (
-            URIRef(hdf_file + "#" + dataset),
-            URIRef(namespaces[0] + 'format'),
-            Literal(isa_tab[-1].split('.')[-1])
-        )
-    )
+    reserved = [k for k in attributes if k.startswith(PROVENANCE_PREFIX)]
+    if reserved:
+        print(', '.join(reserved), "is reserved and not written to", obj.name)
+        attributes = {k: v for k, v in attributes.items() if k not in reserved}
+    if len(attributes) > table_threshold:
+        _write_attribute_table(obj, attributes)
+        return
+    typed = [(k, _typed_values(v)) for k, v in attributes.items()]
+    for k, v in typed:
+        obj.attrs.create(k, v)
 
 
-def generate_rdf(hdf_file):
-    """Generate an RDF file based on an HDF5 file.
+def _typed_values(values):
+    """Convert attribute values to the most compact numpy array.
+    Values are only converted when no information is lost.
 
     Arguments:
-        hdf_file: HDF5 file to generate an RDF from.
-    """
-    rdf_file = hdf_file.split('/')[-1] + ".rdf"
-    if os.path.isfile(rdf_file):
-        print(hdf_file.split('/')[-1] + ".rdf already exists!")
+        values: A value or list of values.
+
+    Returns:
+        numpy.ndarray with the values.
+    """
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    values = [str(v) for v in values]
+    try:
+        numbers = [int(v) for v in values]
+        limits = np.iinfo(np.int64)
+        if [str(n) for n in numbers] == values and \
+                all(limits.min <= n <= limits.max for n in numbers):
+            return np.array(numbers, dtype=np.int64)
+    except ValueError:
+        pass
+    try:
+        numbers = [float(v) for v in values]
+        if [repr(n) for n in numbers] == values and \
+                all(any(c.isdigit() for c in v) for v in values):
+            return np.array(numbers, dtype=np.float64)
+    except ValueError:
+        pass
+    try:
+        dates = [datetime.date.fromisoformat(v).isoformat() for v in values]
+        if dates == values:
+            return np.array(dates, dtype='S10')
+    except ValueError:
         pass
+    return np.array(values, dtype=h5py.string_dtype())
+
+
+def _write_attribute_table(obj, attributes):
+    """Store the attributes of an object in a compressed attribute
+    table dataset with a row per attribute value.
+
+    Arguments:
+        obj: HDF5 group or dataset.
+        attributes: Dictionary with a value or list of values per attribute.
+    """
+    path = ATTRIBUTES_GROUP + obj.name.rstrip('/') + '/' + ATTRIBUTE_TABLE
+    merged = {}
+    if path in obj.file:
+        merged = _read_attribute_table(obj.file[path])
+        del obj.file[path]
+    for k, v in attributes.items():
+        merged[k] = [str(x) for x in v] if isinstance(v, (list, tuple)) else [str(v)]
+    rows = np.array(
+        [(k, x) for k, values in merged.items() for x in values],
+        dtype=[('name', h5py.string_dtype()), ('value', h5py.string_dtype())]
+    )
+    obj.file.create_dataset(path, data=rows, chunks=True, compression='gzip')
+
+
+def _read_attribute_table(table):
+    """Read an attribute table dataset.
+
+    Arguments:
+        table: HDF5 dataset written by _write_attribute_table.
+
+    Returns:
+        Dictionary with a list of values per attribute.
+    """
+    attributes = {}
+    for name, value in table[:]:
+        attributes.setdefault(name.decode('utf-8'), []).append(value.decode('utf-8'))
+    return attributes
+
+
+def content_key(digest, in_file, stream=False, attributes=None):
+    """Build the deduplication key of an input file from the digest of
+    the file, so duplicates are found before they are decoded.
+    The key includes the storage type and a hash of the attributes.
+    Linked datasets share one object and its attributes, so only content
+    that is stored the same way with the same attributes is linked.
+
+    Arguments:
+        digest: Digest of the input file, see file_digest.
+        in_file: Input file.
+
+    Keyword Arguments:
+        stream: The stream option used to store text files. (default: {False})
+        attributes: Attributes of the dataset. (default: {None})
+
+    Returns:
+        The BLAKE2 hex digest followed by the storage type and the
+        hash of the attributes.
+    """
+    if in_file.split('.')[-1] in IMAGE_EXTENSIONS:
+        kind = 'image'
+    elif stream:
+        kind = 'bytes' if stream is True else 'bytes-' + stream
     else:
-        print("Making RDF file...")
-        open(rdf_file, 'a').close()
-    datasets = []
-    g = Graph().parse(rdf_file, format='turtle')
-    c = 0
-    namespaces = get_namespaces(g)
+        kind = 'text'
+    attributes = {
+        k: list(v) if isinstance(v, (list, tuple)) else [v]
+        for k, v in sorted((attributes or {}).items())
+    }
+    attributes_hash = hashlib.blake2b(json.dumps(
+        attributes, sort_keys=True, default=str).encode('utf-8'),
+        digest_size=10).hexdigest()
+    return digest + '-' + kind + '-' + attributes_hash
+
+
+def file_digest(in_file):
+    """Hash the content of a file in blocks of TEXT_BLOCK_SIZE bytes.
+
+    Arguments:
+        in_file: Input file.
+
+    Returns:
+        The BLAKE2 hex digest of the file.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(in_file, 'rb') as ocf:
+        for block in iter(lambda: ocf.read(TEXT_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_provenance(dset, source):
+    """Store where a dataset came from as attributes: the path, size and
+    modification time of its input file, with names starting with
+    PROVENANCE_PREFIX. Datasets that already have a source,
+    i.e. deduplicated content, keep their first source.
+
+    Arguments:
+        dset: HDF5 dataset.
+        source: Dictionary with the path, size and mtime of the input
+        file, see sync_jobs.
+    """
+    if PROVENANCE_PREFIX + 'source_path' in dset.attrs:
+        return
+    dset.attrs[PROVENANCE_PREFIX + 'source_path'] = source['path']
+    dset.attrs[PROVENANCE_PREFIX + 'source_size'] = source['size']
+    dset.attrs[PROVENANCE_PREFIX + 'source_mtime'] = datetime.datetime.fromtimestamp(
+        source['mtime'] / 1e9, datetime.timezone.utc).isoformat()
+
+
+class BlockDigest:
+    """Streaming checksum of the bytes stored in a dataset.
+    The bytes are hashed with BLAKE2 in blocks of block_size bytes and
+    the checksum is the BLAKE2 hash of the block hashes, so the blocks of
+    a dataset can be verified in parallel, see verify.
+
+    Keyword Arguments:
+        block_size: Number of bytes per block. (default: {CHECKSUM_BLOCK})
+    """
+
+    def __init__(self, block_size=CHECKSUM_BLOCK):
+        self.block_size = block_size
+        self.blocks = []
+        self.block = hashlib.blake2b(digest_size=20)
+        self.filled = 0
+
+    def update(self, data):
+        """Hash the next bytes.
+
+        Arguments:
+            data: Bytes or numpy.ndarray, arrays are hashed in C order.
+        """
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        data = memoryview(data)
+        while len(data):
+            size = min(len(data), self.block_size - self.filled)
+            self.block.update(data[:size])
+            self.filled += size
+            data = data[size:]
+            if self.filled == self.block_size:
+                self.blocks.append(self.block.digest())
+                self.block = hashlib.blake2b(digest_size=20)
+                self.filled = 0
+
+    def hexdigest(self):
+        """Get the checksum of the bytes so far.
+
+        Returns:
+            The checksum as blake2b:<block size>:<hex digest>.
+        """
+        return _tree_digest(self.digests(), self.block_size)
+
+    def digests(self):
+        """Get the BLAKE2 digests of the blocks so far.
+
+        Returns:
+            List of digests, including the last partial block.
+        """
+        return self.blocks + [self.block.digest()] if self.filled else list(self.blocks)
+
+
+def _tree_digest(blocks, block_size):
+    """Combine block hashes into a checksum, see BlockDigest.
+
+    Arguments:
+        blocks: List of the BLAKE2 digests of the blocks.
+        block_size: Number of bytes per block.
+
+    Returns:
+        The checksum as blake2b:<block size>:<hex digest>.
+    """
+    tree = hashlib.blake2b(digest_size=20)
+    for block in blocks or [hashlib.blake2b(digest_size=20).digest()]:
+        tree.update(block)
+    return 'blake2b:{}:{}'.format(block_size, tree.hexdigest())
+
+
+@profiled
+def verify(hdf_file, workers=None):
+    """Verify the checksums of all datasets in an HDF5 file.
+    The datasets are read and hashed in blocks by a pool of worker
+    processes, large datasets are split over several workers.
+    A dataset is corrupt when its checksum differs, its checksum can not
+    be parsed or the dataset can not be read, and missing when it is in the sources table but not in the file.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Keyword Arguments:
+        workers: Number of worker processes, None uses all CPUs.
+        (default: {None})
+
+    Returns:
+        Dictionary with the lists of ok, corrupt, missing and unchecked
+        datasets. Unchecked datasets have no checksum.
+    """
+    start = time.time()
+    report = {'ok': [], 'corrupt': [], 'missing': [], 'unchecked': []}
+    checksums = {}
+    errors = {}
+    tasks = []
+    with h5py.File(hdf_file, 'r') as f:
+        sources = read_sources(f)
+        for name, dset in h5py_dataset_iterator(f):
+            checksum = dset.attrs.get(CHECKSUM_ATTRIBUTE)
+            if checksum is None:
+                report['unchecked'].append(name)
+                continue
+            if isinstance(checksum, bytes):
+                checksum = checksum.decode('utf-8', 'replace')
+            checksums[name] = checksum
+            try:
+                block_size = _checksum_block_size(checksum)
+            except ValueError as e:
+                errors[name] = str(e)
+                continue
+            if dset.dtype.kind == 'O' or not dset.shape:
+                tasks.append((name, 0, None, block_size))
+                continue
+            nbytes = dset.size * dset.dtype.itemsize
+            step = block_size * VERIFY_TASK_BLOCKS
+            for offset in range(0, nbytes, step):
+                tasks.append((name, offset, min(offset + step, nbytes), block_size))
+            if not nbytes:
+                tasks.append((name, 0, 0, block_size))
+    report['missing'] = sorted(name for name in sources if name not in checksums
+                               and name not in report['unchecked'])
+    blocks = {name: {} for name in checksums}
+    nbytes = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_digest_blocks, hdf_file, name, offset, stop, block_size):
+            (name, offset) for name, offset, stop, block_size in tasks
+        }
+        for future in futures:
+            name, offset = futures[future]
+            try:
+                digests, size = future.result()
+            except Exception as e:
+                errors.setdefault(name, '{}: {}'.format(type(e).__name__, e))
+                continue
+            blocks[name][offset] = digests
+            nbytes += size
+    for name, checksum in checksums.items():
+        if name not in errors:
+            digests = [d for offset in sorted(blocks[name]) for d in blocks[name][offset]]
+            if _tree_digest(digests, _checksum_block_size(checksum)) == checksum:
+                report['ok'].append(name)
+                continue
+            errors[name] = "checksum mismatch"
+        report['corrupt'].append(name)
+        print(name, "is corrupt:", errors[name])
+    for name in report['missing']:
+        print(name, "is missing")
+    profile_bytes('verify', nbytes)
+    elapsed = max(time.time() - start, 1e-9)
+    print("Verified {} datasets ({:.1f} MB) in {:.2f}s, {:.1f} MB/s: {} ok, {} corrupt, "
+          "{} missing, {} without checksum".format(
+              len(checksums), nbytes / 1e6, elapsed, nbytes / 1e6 / elapsed,
+              len(report['ok']), len(report['corrupt']), len(report['missing']),
+              len(report['unchecked'])))
+    return report
+
+
+def _checksum_block_size(checksum):
+    """Get the block size of a checksum, see BlockDigest.
+
+    Arguments:
+        checksum: Value of the checksum attribute.
+
+    Raises:
+        ValueError: The value is not a checksum of BlockDigest.
+
+    Returns:
+        The number of bytes per block.
+    """
+    parts = checksum.split(':') if isinstance(checksum, str) else []
+    if len(parts) != 3 or parts[0] != 'blake2b' or not parts[1].isdigit() \
+            or not int(parts[1]):
+        raise ValueError("unparsable checksum " + repr(checksum))
+    return int(parts[1])
+
+
+def _digest_blocks(hdf_file, name, start, stop, block_size):
+    """Hash a byte range of a dataset in blocks, see verify.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        name: Name of the dataset.
+        start: First byte, a multiple of block_size.
+        stop: End of the range or None for a variable length dataset,
+        which is hashed completely.
+        block_size: Number of bytes per block.
+
+    Returns:
+        Tuple of the list of block digests and the number of bytes read.
+    """
+    digest = BlockDigest(block_size)
     with h5py.File(hdf_file, 'r') as f:
-        for (path, dummydset) in h5py_dataset_iterator(f):
-            datasets.append(path)
-        if os.path.isfile(rdf_file):
-            with open(rdf_file) as rdfile:
-                contents = rdfile.read()
-                for dataset in datasets:
-                    if rdf_file in contents:
-                        print(dataset, "is already in RDF")
-                    else:
-                        count = 0
-                        uid_str = uuid.uuid4().urn
-                        identifier = uid_str[9:]
-                        isa_tab = dataset.split('/')
-                        catalog = "/"
-                        isa_labels = {
-                            1: "project",
-                            2: "investigation",
-                            3: "study",
-                            4: "assay"
-                        }
-                        for cat in isa_tab[1:-1]:
-                            count += 1
-                            add_isa_triples(g, hdf_file, cat, isa_labels, isa_tab, count)
-                            catalog += (cat + "/")
-                        all_attr = list(f[dataset].attrs)
-                        add_hdf_trples(g, hdf_file, dataset, catalog, isa_tab, identifier)
-                        for attr in all_attr:
-                            f[dataset].attrs.get(attr)
-                            predicate = URIRef(
-                                namespaces[1] + attr.replace(" ",  "-"))
-                            try:
-                                attr_value = f[dataset].attrs.get(attr)
-                            except AttributeError:
-                                literal_object = Literal(attr_value[0])
-                            if len(attr_value) > 1:
-                                for value in attr_value:
-                                    literal_object = Literal(value)
-                                    g.add(
-                                        (
-                                            URIRef(hdf_file + "#" + dataset),
-                                            predicate,
-                                            literal_object
-                                        )
-                                    )
-                            else:
-                                literal_object = Literal(attr_value[0])
-                                g.add(
-                                    (
-                                        URIRef(hdf_file + "#" + dataset),
-                                        predicate,
-                                        literal_object
-                                    )
-                                )
-                            c += 1
-                        g.parse(hdf_file.split('/')
-                                [-1] + ".rdf", format="turtle")
-            g.serialize(destination=hdf_file.split('/')[-1] + ".rdf", format="turtle")
-            print("Finished!")
+        dset = f[name]
+        if stop is None:
+            size = 0
+            for value in np.ravel(dset[()]) if dset.dtype.kind == 'O' else [dset[()]]:
+                if isinstance(value, str):
+                    value = value.encode('utf-8')
+                digest.update(value if isinstance(value, bytes) else np.asarray(value))
+                size += len(value) if isinstance(value, bytes) else value.nbytes
+        else:
+            row_bytes = dset.dtype.itemsize * int(np.prod(dset.shape[1:], dtype=np.int64))
+            for offset in range(start, stop, block_size):
+                end = min(offset + block_size, stop)
+                first = offset // row_bytes
+                rows = dset[first:-(-end // row_bytes)]
+                skip = offset - first * row_bytes
+                digest.update(memoryview(
+                    np.ascontiguousarray(rows).reshape(-1).view(np.uint8))[skip:skip + end - offset])
+            size = stop - start
+    return digest.digests(), size
+
+
+def read_sources(data_file):
+    """Read the sources table with the input file of every dataset.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+
+    Returns:
+        Dictionary with the path, size, mtime and hash per dataset name.
+    """
+    sources = {}
+    if SOURCES_TABLE in data_file:
+        for name, path, size, mtime, digest in data_file[SOURCES_TABLE][:]:
+            sources[_absolute_name(name.decode('utf-8'))] = {
+                'path': path.decode('utf-8'),
+                'size': int(size),
+                'mtime': int(mtime),
+                'hash': digest.decode('utf-8')
+            }
+    return sources
+
+
+def write_sources(data_file, sources):
+    """Replace the sources table, see read_sources.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+        sources: Dictionary with the source of every dataset.
+    """
+    if data_file.mode == 'r':
+        return
+    if SOURCES_TABLE in data_file:
+        del data_file[SOURCES_TABLE]
+    if not sources:
+        return
+    rows = np.array(
+        [(name, s['path'], s['size'], s['mtime'], s['hash'])
+         for name, s in sorted(sources.items())],
+        dtype=[('name', h5py.string_dtype()), ('path', h5py.string_dtype()),
+               ('size', 'i8'), ('mtime', 'i8'), ('hash', h5py.string_dtype())]
+    )
+    data_file.create_dataset(SOURCES_TABLE, data=rows, chunks=True,
+                             compression='gzip')
+
+
+def sync_jobs(data_file, jobs, sources, sync=None):
+    """Compare ingestion jobs with the sources table of the HDF5 file.
+
+    With sync 'stat' a dataset is up to date when the path, size and
+    modification time of its input file did not change. With sync 'hash'
+    an input file with a new modification time but the same size is
+    hashed and only counts as changed when the content differs.
+    Outdated datasets are deleted so they can be added again.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+        jobs: Iterable of (input file, dataset name, attributes) tuples.
+        sources: Dictionary from read_sources, up to date entries are
+        refreshed in place.
+
+    Keyword Arguments:
+        sync: None, 'stat' or 'hash'. None adds every input file.
+        (default: {None})
+
+    Returns:
+        Generator of (input file, dataset name, attributes, source) tuples
+        for the input files that have to be added. The dataset names
+        start with a slash, see _absolute_name.
+    """
+    for in_file, name, attributes in jobs:
+        name = _absolute_name(name)
+        try:
+            stat = os.stat(in_file)
+        except FileNotFoundError:
+            print(in_file, "not found")
+            continue
+        state = {'path': os.path.abspath(in_file), 'size': stat.st_size,
+                 'mtime': stat.st_mtime_ns, 'hash': ''}
+        recorded = sources.get(name)
+        if sync and recorded is not None and name in data_file:
+            if recorded['path'] == state['path'] and recorded['size'] == state['size']:
+                if recorded['mtime'] == state['mtime']:
+                    continue
+                if sync == 'hash':
+                    state['hash'] = file_digest(in_file)
+                    if state['hash'] == recorded['hash']:
+                        sources[name] = state
+                        continue
+            print(name, "is outdated")
+        if sync and name in data_file:
+            _delete_object(data_file, name)
+        if sync == 'hash' and not state['hash']:
+            state['hash'] = file_digest(in_file)
+        yield in_file, name, attributes, state
+
+
+def _absolute_name(name):
+    """Normalize a dataset name to the absolute path h5py reports,
+    so a group entered without a leading slash matches the file.
+
+    Arguments:
+        name: Dataset name.
+
+    Returns:
+        The name with a single leading slash.
+    """
+    return '/' + name.lstrip('/')
+
+
+@profiled
+def prune_sources(out_file):
+    """Delete the datasets whose input file no longer exists.
+
+    Arguments:
+        out_file: HDF5 file.
+
+    Returns:
+        List of deleted dataset names.
+    """
+    with open_hdf(out_file) as data_file:
+        sources = read_sources(data_file)
+        removed = sorted(
+            name for name, source in sources.items()
+            if not os.path.exists(source['path'])
+        )
+        for name in removed:
+            if name in data_file:
+                _delete_object(data_file, name)
+            del sources[name]
+            print(name, "deleted, its source is gone")
+        _prune_content(data_file)
+        write_sources(data_file, sources)
+    return removed
+
+
+def _link_content(data_file, key, name):
+    """Link a dataset name to stored content with the same key.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+        key: Content key from content_key.
+        name: Name of the new dataset.
+
+    Returns:
+        The linked HDF5 dataset or None when the content is not stored yet.
+    """
+    content = data_file.get(CONTENT_GROUP)
+    if content is None or key not in content:
+        return None
+    if name in data_file:
+        if data_file[name] == content[key]:
+            print(name, "is already present")
+            return data_file[name]
+        return None
+    data_file[name] = content[key]
+    for companion, suffix in CONTENT_COMPANIONS:
+        if key + suffix in content:
+            data_file[companion + name] = content[key + suffix]
+    print(name, "is linked to identical content")
+    return data_file[name]
+
+
+def _index_content(data_file, key, dset):
+    """Add a new dataset to the content index.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+        key: Content key from content_key.
+        dset: The dataset with the content.
+    """
+    data_file[CONTENT_GROUP + '/' + key] = dset
+    for companion, suffix in CONTENT_COMPANIONS:
+        if companion + dset.name in data_file:
+            data_file[CONTENT_GROUP + '/' + key + suffix] = \
+                data_file[companion + dset.name]
+
+
+def _prune_content(data_file):
+    """Remove content from the content index that is
+    no longer linked from anywhere else.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+    """
+    content = data_file.get(CONTENT_GROUP)
+    if content is None:
+        return
+    suffixes = tuple(suffix for _, suffix in CONTENT_COMPANIONS)
+    for key in list(content):
+        if key in content and not key.endswith(suffixes) \
+                and h5py.h5o.get_info(content[key].id).rc == 1:
+            del content[key]
+            for suffix in suffixes:
+                if key + suffix in content:
+                    del content[key + suffix]
+
+
+def write_batch(in_files, out_file, groups, workers=None, queue_size=None,
+                chunk_rows=64, compression_opts=4, stream=False, dedup=False,
+                sync=None, pyramid=False):
+    """Write the HDF5 file based on the input files using a pool of
+    worker processes. The workers read, decode and compress the input
+    files, the HDF5 file itself is only written by this process.
+
+    Arguments:
+        in_files: List of input file to add to the HDF5 file.
+        out_file: HDF5 output file.
+        groups: The group structure.
+
+    Keyword Arguments:
+        workers: Number of worker processes, None uses all CPUs.
+        (default: {None})
+        queue_size: Maximum number of decoded files waiting to be written.
+        None uses twice the number of workers. (default: {None})
+        chunk_rows: Number of image rows per chunk. (default: {64})
+        compression_opts: Gzip level used by the workers. (default: {4})
+        stream: Store text files as compressed byte datasets. (default: {False})
+        dedup: Store identical input files once. (default: {False})
+        sync: Only add new or changed input files, see sync_jobs.
+        (default: {None})
+        pyramid: Store downsampled levels of images, they are built from
+        the written dataset by this process. (default: {False})
+    """
+    jobs = (
+        (in_file, groups[0 if len(groups) == 1 else count] + in_file.split('/')[-1], None)
+        for count, in_file in enumerate(in_files)
+    )
+    _write_jobs(out_file, jobs, workers, queue_size, chunk_rows,
+                compression_opts, stream, dedup, sync, pyramid)
+
+
+@profiled
+def _write_jobs(out_file, jobs, workers=None, queue_size=None,
+                chunk_rows=64, compression_opts=4, stream=False, dedup=False,
+                sync=None, pyramid=False):
+    """Prepare input files in a process pool and write them to the HDF5 file.
+
+    Arguments:
+        out_file: HDF5 output file.
+        jobs: Iterable of (input file, dataset name, attributes) tuples.
+        Attributes that are None are asked for when the dataset is written.
+        Input files that can not be read or decoded are reported and
+        skipped, the sources table is always written.
+
+    Keyword Arguments:
+        See write_batch.
+    """
+    if queue_size is None:
+        queue_size = 2 * (workers or os.cpu_count() or 1)
+    jobs = iter(jobs)
+    files = 0
+    failed = 0
+    nbytes = 0
+    start = time.time()
+    with open_hdf(out_file) as data_file, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        sources = read_sources(data_file)
+        jobs = sync_jobs(data_file, jobs, sources, sync)
+        pending = {}
+        try:
+            while True:
+                for in_file, name, attributes, state in jobs:
+                    pending[pool.submit(
+                        _prepare_input, in_file, name, chunk_rows,
+                        compression_opts, stream, dedup and not state['hash']
+                    )] = in_file, attributes, state
+                    if len(pending) >= queue_size:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_file, attributes, state = pending.pop(future)
+                    try:
+                        prepared = future.result()
+                    except FileNotFoundError as e:
+                        print(e.filename, "not found")
+                        failed += 1
+                        continue
+                    except Exception as e:
+                        print(in_file, "could not be read:", e)
+                        failed += 1
+                        continue
+                    if attributes is None:
+                        attributes = generate_attributes_to_add(prepared['name'])
+                    dset = None
+                    if dedup:
+                        key = content_key(state['hash'] or prepared['digest'],
+                                          state['path'], stream, attributes)
+                        dset = _link_content(data_file, key, prepared['name'])
+                    if dset is None:
+                        dset = _write_prepared(data_file, prepared)
+                        if pyramid and prepared['kind'] == 'image':
+                            build_pyramid(dset)
+                        if dedup:
+                            _index_content(data_file, key, dset)
+                    write_attributes(dset, attributes)
+                    write_provenance(dset, state)
+                    sources[prepared['name']] = state
+                    files += 1
+                    nbytes += prepared['nbytes']
+        finally:
+            write_sources(data_file, sources)
+    elapsed = max(time.time() - start, 1e-9)
+    print("Wrote {} files ({:.1f} MB) in {:.2f}s: {:.1f} files/s, {:.1f} MB/s, "
+          "{} failed".format(files, nbytes / 1e6, elapsed, files / elapsed,
+                             nbytes / 1e6 / elapsed, failed))
+
+
+def _prepare_input(in_file, name, chunk_rows, compression_opts, stream=False,
+                   digest=False):
+    """Read and decode an input file in a worker process.
+    Images and streamed text files are split into chunks that are
+    compressed with the same deflate stream the HDF5 gzip filter writes.
+
+    Arguments:
+        in_file: Input file.
+        name: Name of the dataset in the HDF5 file.
+        chunk_rows: Number of image rows per chunk.
+        compression_opts: Gzip compression level.
+
+    Keyword Arguments:
+        stream: Prepare text files as byte datasets. (default: {False})
+        digest: Also add the digest of the input file for the
+        deduplication key, see file_digest. (default: {False})
+
+    Returns:
+        Dictionary with the decoded input ready to be written and the
+        checksum of the bytes, see BlockDigest.
+    """
+    prepared = _decode_input(in_file, name, chunk_rows, compression_opts, stream)
+    if digest:
+        prepared['digest'] = file_digest(in_file)
+    return prepared
+
+
+def _decode_input(in_file, name, chunk_rows, compression_opts, stream=False):
+    """Read and decode an input file, see _prepare_input.
+
+    Returns:
+        Dictionary with the decoded input ready to be written.
+    """
+    if stream and in_file.split('.')[-1] not in IMAGE_EXTENSIONS:
+        prepared = {'name': name, 'kind': 'bytes', 'chunks': [], 'nbytes': 0,
+                    'compression_opts': compression_opts, 'offsets': []}
+        last_byte = 10
+        digest = BlockDigest()
+        with open(in_file, 'rb') as ocf:
+            for block in iter(lambda: ocf.read(TEXT_BLOCK_SIZE), b''):
+                digest.update(block)
+                if stream is not True:
+                    data = np.frombuffer(block, dtype=np.uint8)
+                    prepared['offsets'].append(_record_starts(
+                        data, last_byte, stream, prepared['nbytes']))
+                    last_byte = block[-1]
+                prepared['chunks'].append((prepared['nbytes'], zlib.compress(
+                    block.ljust(TEXT_BLOCK_SIZE, b'\0'), compression_opts)))
+                prepared['nbytes'] += len(block)
+        prepared['shape'] = (prepared['nbytes'],)
+        prepared['index'] = None if stream is True else stream
+        prepared['checksum'] = digest.hexdigest()
+        return prepared
+    if in_file.split('.')[-1] not in IMAGE_EXTENSIONS:
+        with open(in_file) as ocf:
+            data = ocf.read()
+        digest = BlockDigest()
+        digest.update(data.encode('utf-8'))
+        return {'name': name, 'kind': 'text', 'data': data,
+                'nbytes': len(data), 'checksum': digest.hexdigest()}
+    prepared = {'name': name, 'kind': 'image', 'chunks': [],
+                'nbytes': 0, 'compression_opts': compression_opts}
+    digest = BlockDigest()
+    with Image.open(in_file) as img:
+        width, height = img.size
+        for row, strip in _iter_image_strips(img, chunk_rows):
+            digest.update(strip)
+            prepared['nbytes'] += strip.nbytes
+            if strip.shape[0] < chunk_rows:
+                padded = np.zeros((chunk_rows,) + strip.shape[1:], strip.dtype)
+                padded[:strip.shape[0]] = strip
+                strip = padded
+            prepared['shape'] = (height, width, strip.shape[2])
+            prepared['dtype'] = strip.dtype.str
+            prepared['chunk_shape'] = (chunk_rows, width, strip.shape[2])
+            prepared['chunks'].append((row, zlib.compress(
+                np.ascontiguousarray(strip).tobytes(), compression_opts)))
+    prepared['checksum'] = digest.hexdigest()
+    return prepared
+
+
+@profiled
+def _write_prepared(data_file, prepared):
+    """Commit the output of _prepare_input to the HDF5 file.
+
+    Arguments:
+        data_file: Opened HDF5 file.
+        prepared: Dictionary returned by _prepare_input.
+
+    Returns:
+        The created HDF5 dataset.
+    """
+    if prepared['kind'] == 'text':
+        dset = data_file.create_dataset(
+            prepared['name'], data=prepared['data'], shape=(1,),
+            dtype=h5py.special_dtype(vlen=str)
+        )
+        dset.attrs[CHECKSUM_ATTRIBUTE] = prepared['checksum']
+        return dset
+    if prepared['kind'] == 'bytes':
+        dset = data_file.create_dataset(
+            prepared['name'], shape=prepared['shape'], maxshape=(None,),
+            dtype=np.uint8, chunks=(TEXT_BLOCK_SIZE,), compression='gzip',
+            compression_opts=prepared['compression_opts']
+        )
+        for offset, chunk in prepared['chunks']:
+            dset.id.write_direct_chunk((offset,), chunk)
+        if prepared['index'] is not None:
+            offsets = _create_offsets(dset, prepared['index'])
+            for starts in prepared['offsets']:
+                _append_offsets(offsets, starts)
+        dset.attrs[CHECKSUM_ATTRIBUTE] = prepared['checksum']
+        return dset
+    dset = data_file.create_dataset(
+        prepared['name'], shape=prepared['shape'],
+        dtype=np.dtype(prepared['dtype']),
+        chunks=prepared['chunk_shape'], compression='gzip',
+        compression_opts=prepared['compression_opts']
+    )
+    for row, chunk in prepared['chunks']:
+        dset.id.write_direct_chunk((row, 0, 0), chunk)
+    dset.attrs[CHECKSUM_ATTRIBUTE] = prepared['checksum']
+    profile_bytes('_write_prepared', prepared['nbytes'])
+    return dset
+
+
+def generate_attributes_to_add(group_name):
+    """ Search ontology lookup service and create a list of attributes 
+    to add to a dataset. At the moment the information stored from OLS
+    is the name, iri and description.
+
+    Arguments:
+        group_name: The name of the group in which the dataset is located.
+
+    Returns:
+        Dictionary of attributes. Key is the name and 
+        the values are the description and iri.
+    """
+    attributes = dict()
+    print("Enter attributes for " + group_name)
+    meta = input("Is there a metadata file? (Y/N): ")
+    if meta == "Y" or meta == "y":
+        metapath = input("Enter metadata file path: ")
+        attributes = read_metadata_file(metapath)
+    else:
+        while True:
+            print()
+            print("Enter attributes for " + group_name)
+            ontosearching = input("Search ontologies? Y/N: ")
+            if ontosearching == "Y" or ontosearching == "y":
+                print("Please enter the attribute name and search term")
+                print("i.e. Format fasta")
+                attr = input("")
+                attr_name = attr.split(' ')[0]
+                ontolist = ontologies(attr.split(' ')[1])
+                print("ID -- Name -- Description -- IRI")
+                print()
+                for onto in enumerate(ontolist):
+                    print(onto[0], "--", onto[1][0], "--",
+                        onto[1][1], "--", onto[1][2])
+                select_onto = input(
+                    "Select an ontology description(s) to add (comma seperated): ")
+                if select_onto == '':
+                    pass
+                else:
+                    for select in select_onto.split(','):
+                        added_onto = ontolist[int(select)]
+                        attributes[attr_name + "Description"] = [added_onto[1]]
+                        attributes[attr_name + "IRI"] = [added_onto[2]]
+            else:
+                naturalis_term = input("Add a Naturalis specimen ID: ")
+                naturalis = search_naturalis(naturalis_term)
+                for nitem, nvalue in naturalis.items():
+                    attributes[nitem] = [nvalue]
+            continue_attr = input("Add another attribute? (Y/N): ")
+            if continue_attr == "y" or continue_attr == "Y":
+                True
+            else:
+                break
+    return attributes
+
+
+def generate_groups_to_delete():
+    """Enter the groups to delete and 
+    return a list of groups to remove from the HDF5 file.
+
+    Returns:
+        A list with all entered groups to delete from the HDF5 file.
+    """
+    groups_to_delete = []
+    while True:
+        datasetname = input("Enter dataset name or pattern (i.e. /Project/*/Assay*) to delete: ")
+        groups_to_delete.append(datasetname)
+        continue_del = input("Add another dataset to delete? (Y/N): ")
+        if continue_del == "y" or continue_del == "Y":
+            True
+        else:
+            break
+    return groups_to_delete
+
+
+def find_datasets(name, node):
+    """Read the nodes from the h5py visititems function
+    and check if the node is a dataset.
+
+    TODO: See if this works with different array types.
+    FIXME: Add option for different array types.
+
+    Arguments:
+        name: Name from h5py visititems.
+        node: The group node from h5py visititems.
+    """
+    if name.split('/')[0] == RESERVED_GROUP:
+        pass
+    elif isinstance(node, h5py.Dataset):
+        if node.ndim == 1 and node.dtype == np.uint8:
+            dataset = node
+        elif node.ndim == 3:
+            dataset = node[:]
+        else:
+            dataset = node[:][0]
+        write_dataset(dataset, name.split('/')[-2], name.split('/')[-1])
+    else:
+        pass
+
+
+def get_groups(name):
+    """Get the ISA structure based on the HDF5 group name.
+
+    TODO: Return ISA structure with group names.
+    TODO: Find out want we want with this functionality.
+
+    Arguments:
+        name: The name of the HDF5 group.
+    """
+    groups = {}
+    isa_structure = ["Project", "Investigation", "Study", "Assay"]
+    groupname = name.split('/')[-1]
+    groups[isa_structure[len(name.split('/'))-1]] = groupname
+
+
+@profiled
+def write_dataset(dataset, folder, out_file):
+    """Create files based on the available datasets in the HDF5 file.
+
+    Arguments:
+        dataset: Dataset from the HDF5 file.
+        folder: Directory to save the new dataset file.
+        out_file: Name of the new dataset file.
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    if isinstance(dataset, h5py.Dataset):
+        _write_bytes(dataset, folder + '/' + out_file)
+        return
+    if isinstance(dataset, bytes):
+        dataset = dataset.decode('utf-8')
+    try:
+        with open(folder + '/' + out_file, 'w') as writefile:
+            writefile.write(dataset)
+    except TypeError:
+        with profile_stage('write_dataset.png'):
+            _write_image(dataset, folder + '/' + out_file)
+
+
+@profiled
+def extract_datasets(hdf_file, subtree='/', workers=None, queue_size=None,
+                     level=0):
+    """Create files based on the available datasets in the HDF5 file,
+    like find_datasets. Byte datasets are copied chunk by chunk and
+    images are PNG encoded and written by a pool of worker processes.
+    String datasets and images stored as the first item of a 4-D array
+    by earlier versions are extracted as well, other datasets are skipped.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Keyword Arguments:
+        subtree: Only extract the datasets in this group. (default: {'/'})
+        workers: Number of worker processes, None uses all CPUs.
+        (default: {None})
+        queue_size: Maximum number of images waiting to be encoded.
+        None uses twice the number of workers. (default: {None})
+        level: Extract images at this zoom level for a quick preview,
+        see read_region. (default: {0})
+
+    Returns:
+        Number of extracted datasets.
+    """
+    if queue_size is None:
+        queue_size = 2 * (workers or os.cpu_count() or 1)
+    prefix = subtree.rstrip('/') + '/'
+    datasets = [
+        path for path in load_catalog(hdf_file)['datasets']
+        if path.startswith(prefix) or path == subtree
+    ]
+    for folder in set(path.split('/')[-2] or '.' for path in datasets):
+        os.makedirs(folder, exist_ok=True)
+    with h5py.File(hdf_file, 'r') as f, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        skipped = 0
+        for path in datasets:
+            node = f[path]
+            out_file = (path.split('/')[-2] or '.') + '/' + path.split('/')[-1]
+            if node.ndim == 1 and node.dtype == np.uint8:
+                _write_bytes(node, out_file)
+                continue
+            if node.dtype.kind in 'OSU':
+                text = node[(0,) * node.ndim]
+                if isinstance(text, bytes):
+                    text = text.decode('utf-8')
+                if isinstance(text, str):
+                    with open(out_file, 'w') as writefile:
+                        writefile.write(text)
+                    continue
+            elif node.ndim in (2, 3, 4) and node.dtype.kind in 'biuf':
+                if node.ndim == 3:
+                    image = read_region(node, level=level)
+                elif node.ndim == 4:
+                    image = node[0]
+                else:
+                    image = node[:]
+                if len(pending) >= queue_size:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(pool.submit(_write_image, image, out_file))
+                continue
+            print(path, "is not a text or image dataset and is skipped")
+            skipped += 1
+        for future in pending:
+            future.result()
+    return len(datasets) - skipped
+
+
+@profiled
+def _write_bytes(dataset, out_file):
+    """Write a byte dataset to a file one chunk at a time.
+
+    Arguments:
+        dataset: HDF5 dataset with the bytes of a text file.
+        out_file: Path of the new file.
+    """
+    block_size = dataset.chunks[0] if dataset.chunks else TEXT_BLOCK_SIZE
+    with open(out_file, 'wb') as writefile:
+        for start in range(0, dataset.shape[0], block_size):
+            writefile.write(read_text_range(dataset, start, start + block_size))
+    profile_bytes('_write_bytes', dataset.shape[0])
+
+
+def _write_image(dataset, out_file):
+    """Save an image dataset as PNG file.
+
+    Arguments:
+        dataset: numpy.ndarray with the image data.
+        out_file: Path of the new file.
+    """
+    if dataset.ndim == 3 and dataset.shape[2] == 1:
+        dataset = dataset[:, :, 0]
+    im = Image.fromarray(dataset.astype('uint8'))
+    im.save(out_file, "PNG")
+
+
+def h5py_dataset_iterator(fc, prefix=''):
+    """Iterate through file content and get the dataset paths in the HDF5 file.
+
+    Arguments:
+        fc: HDF5 file content.
+
+    Keyword Arguments:
+        prefix: Group name prefix. 
+        The default is '' as there is no group available before first one.
+        (default: {''})
+    """
+    for key in fc.keys():
+        if prefix == '' and key == RESERVED_GROUP:
+            continue
+        item = fc[key]
+        path = '{}/{}'.format(prefix, key)
+        if isinstance(item, h5py.Dataset):
+            yield (path, item)
+        elif isinstance(item, h5py.Group):
+            yield from h5py_dataset_iterator(item, path)
+
+
+@profiled
+def get_attr(hdf_file):
+    """Print all attributes from input HDF5 file.
+
+    Arguments:
+        hdf_file: HDF5 file to get the attributes from.
+    """
+    catalog = load_catalog(hdf_file)
+    for dataset, info in catalog['datasets'].items():
+        print(dataset, "has the following attributes:")
+        for attr, values in info['attrs'].items():
+            for val in values:
+                attr_value = str(val)
+                print(attr + ": " + attr_value)
+        print()
+        print()
+
+
+@profiled
+def load_catalog(hdf_file):
+    """Load the metadata catalog of an HDF5 file.
+    The catalog is stored next to the HDF5 file and is rebuilt
+    when the modification time or size of the HDF5 file changed.
+    Loaded catalogs are also kept in memory for the next call.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Returns:
+        Dictionary with the catalog, see build_catalog.
+    """
+    stat = os.stat(hdf_file)
+    catalog = _catalogs.get(os.path.abspath(hdf_file))
+    if catalog is not None and catalog['mtime'] == stat.st_mtime_ns \
+            and catalog['size'] == stat.st_size:
+        return catalog
+    catalog_file = hdf_file + ".catalog.json"
+    try:
+        with open(catalog_file) as catfile:
+            catalog = json.load(catfile)
+        if catalog['mtime'] != stat.st_mtime_ns or catalog['size'] != stat.st_size:
+            catalog = None
+    except (OSError, ValueError, KeyError):
+        catalog = None
+    if catalog is None:
+        catalog = build_catalog(hdf_file)
+        try:
+            with open(catalog_file, 'w') as catfile:
+                json.dump(catalog, catfile, separators=(',', ':'))
+        except OSError:
+            pass
+    _catalogs[os.path.abspath(hdf_file)] = catalog
+    return catalog
+
+
+@profiled
+def build_catalog(hdf_file):
+    """Collect the path, shape, dtype, storage size and attributes of
+    every group and dataset in an HDF5 file in a single pass.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Returns:
+        Dictionary with the mtime and size of the HDF5 file and
+        the groups and datasets with their information by path.
+    """
+    stat = os.stat(hdf_file)
+    catalog = {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'groups': {},
+        'datasets': {}
+    }
+
+    def visit(prefix, group):
+        for key, node in group.items():
+            name = prefix + '/' + key
+            if name == '/' + RESERVED_GROUP:
+                continue
+            attrs = read_attributes(node, tables)
+            if isinstance(node, h5py.Dataset):
+                catalog['datasets'][name] = {
+                    'shape': list(node.shape),
+                    'dtype': str(node.dtype),
+                    'storage': node.id.get_storage_size(),
+                    'attrs': attrs
+                }
+            else:
+                catalog['groups'][name] = {'attrs': attrs}
+                visit(name, node)
+
+    with h5py.File(hdf_file, 'r') as f:
+        tables = f.get(ATTRIBUTES_GROUP)
+        visit('', f)
+    return catalog
+
+
+def read_attributes(obj, tables=False):
+    """Read all attributes of a group or dataset, including the
+    attributes in an attribute table, see write_attributes.
+
+    Arguments:
+        obj: HDF5 group or dataset.
+
+    Keyword Arguments:
+        tables: The attribute table group of the file, None when the file
+        has no attribute tables or False to look it up. (default: {False})
+
+    Returns:
+        Dictionary with a list of values per attribute.
+    """
+    attributes = {k: attr_values(v) for k, v in obj.attrs.items()}
+    if tables is False:
+        tables = obj.file.get(ATTRIBUTES_GROUP)
+    table = (obj.name.rstrip('/') + '/' + ATTRIBUTE_TABLE).lstrip('/')
+    if tables is not None and table in tables:
+        attributes.update(_read_attribute_table(tables[table]))
+    return attributes
+
+
+def attr_values(value):
+    """Convert an HDF5 attribute value to a list of plain Python values.
+
+    Arguments:
+        value: Attribute value as returned by h5py.
+
+    Returns:
+        List with the values of the attribute.
+    """
+    values = value.ravel().tolist() if isinstance(value, np.ndarray) else [value]
+    return [
+        v.decode('utf-8', 'replace') if isinstance(v, bytes)
+        else v.item() if isinstance(v, np.generic) else v
+        for v in values
+    ]
+
+
+NAMESPACE_URIS = [
+    'http://purl.org/dc/terms/',
+    "http://example.org/hdf2rdf/",
+    'http://purl.org/isaterms/',
+    'http://rdfs.org/ns/void#',
+    'http://www.w3.org/ns/dcat#',
+    'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+]
+PREFIXES = ['dcterms', 'hdf2rdf', 'isa', 'void', 'dcat', 'rdf']
+_namespaces = None
+
+
+def get_namespaces(g=None):
+    """Binds the RDF namespaces to the graph.
+    The namespaces are only created once, on first use.
+    
+    Keyword Arguments:
+        g: Triple store graph, None only returns the namespaces.
+        (default: {None})
+
+    Returns:
+        List with the used RDF namespaces.
+    """
+    global _namespaces
+    if _namespaces is None:
+        _namespaces = [rdflib.Namespace(uri) for uri in NAMESPACE_URIS]
+    if g is not None:
+        for prefix, namespace in zip(PREFIXES, _namespaces):
+            g.bind(prefix, namespace)
+    return _namespaces
+
+
+def add_isa_triples(g, hdf_file, isa_title, isa_labels, isa_tab, count):
+    """Adds the ISA triples to the graph.
+    
+    Arguments:
+        g: Triple store graph.
+        hdf_file: The HDF file.
+        isa_title: The ISA title.
+        Either the investigation, study or assay title)
+        isa_labels: The label that belongs to the title.
+        isa_tab: The ISA structure as a list.
+        count: Number that is linked to the ISA catalog.
+    """
+    for triple in isa_triples(hdf_file, isa_title, isa_labels, isa_tab, count):
+        g.add(triple)
+
+
+def isa_triples(hdf_file, isa_title, isa_labels, isa_tab, count, group=True,
+                part=True):
+    """Generate the ISA triples, see add_isa_triples.
+
+    Keyword Arguments:
+        group: Generate the type and isPartOf triples of the group.
+        (default: {True})
+        part: Generate the hasPart triple of the next item in isa_tab.
+        (default: {True})
+
+    Returns:
+        Generator of triples.
+    """
+    namespaces = get_namespaces()
+    if count == 1:
+        if group:
+            yield (
+                rdflib.URIRef(hdf_file + "#" + isa_title),
+                rdflib.URIRef(namespaces[-1] + 'type'),
+                rdflib.Literal(isa_labels.get(count))
+            )
+        if part:
+            yield (
+                rdflib.URIRef(hdf_file + "#" + isa_title),
+                rdflib.URIRef(namespaces[0] + 'hasPart'),
+                rdflib.Literal(hdf_file + "#" + isa_tab[count + 1])
+            )
+    else:
+        if group:
+            yield (
+                rdflib.URIRef(hdf_file + "#" + isa_title),
+                rdflib.URIRef(namespaces[-1] + 'type'),
+                rdflib.URIRef(namespaces[2] + isa_labels.get(count))
+            )
+            yield (
+                rdflib.URIRef(hdf_file + "#" + isa_title),
+                rdflib.URIRef(namespaces[0] + 'isPartOf'),
+                rdflib.Literal(hdf_file + "#" + isa_tab[count - 1])
+            )
+        if not part:
+            return
+        try:
+            yield (
+                rdflib.URIRef(hdf_file + "#" + isa_title),
+                rdflib.URIRef(namespaces[0] + 'hasPart'),
+                rdflib.Literal(hdf_file + "#" + isa_tab[count + 1])
+            )
+        except IndexError:
+            pass
+
+
+def add_hdf_trples(g, hdf_file, dataset, catalog, isa_tab, identifier):
+    """Adds the triples to the graph based on the attributes in the HDF.
+    
+    Arguments:
+        g: Triple store graph
+        hdf_file: The HDF file.
+        dataset: The name of the dataset.
+        catalog: The complete HDF structure linked to the dataset.
+        isa_tab: The ISA structure as a list.
+        identifier {[type]} -- [description]
+    """
+    for triple in hdf_triples(hdf_file, dataset, catalog, isa_tab, identifier):
+        g.add(triple)
+
+
+def hdf_triples(hdf_file, dataset, catalog, isa_tab, identifier):
+    """Generate the dataset triples, see add_hdf_trples.
+
+    Returns:
+        Generator of triples.
+    """
+    namespaces = get_namespaces()
+    subject = rdflib.URIRef(hdf_file + "#" + dataset)
+    yield (subject, rdflib.URIRef(namespaces[0] + 'isPartOf'), rdflib.Literal(catalog))
+    yield (subject, rdflib.URIRef(namespaces[-1] + 'type'), rdflib.URIRef(namespaces[4] + 'Dataset'))
+    yield (subject, rdflib.URIRef(namespaces[4] + 'dataset'), rdflib.Literal(isa_tab[-1]))
+    yield (subject, rdflib.URIRef(namespaces[4] + 'title'), rdflib.Literal(isa_tab[-1].split('.')[0]))
+    yield (subject, rdflib.URIRef(namespaces[4] + 'identifier'), rdflib.Literal(identifier))
+    yield (subject, rdflib.URIRef(namespaces[0] + 'format'), rdflib.Literal(isa_tab[-1].split('.')[-1]))
+
+
+def dataset_triples(hdf_file, dataset, attrs, identifier, isa_done):
+    """Generate the ISA, dataset and attribute triples of a dataset.
+
+    Arguments:
+        hdf_file: The HDF file.
+        dataset: The name of the dataset.
+        attrs: Dictionary with a list of values per attribute.
+        identifier: Identifier of the dataset.
+        isa_done: Set of group paths for which the ISA triples were
+        generated. New group paths are added to the set. The hasPart
+        triple of a group to a dataset is always generated, to another
+        group when that group is new.
+
+    Returns:
+        Generator of triples.
+    """
+    count = 0
+    isa_tab = dataset.split('/')
+    catalog = "/"
+    isa_labels = {
+        1: "project",
+        2: "investigation",
+        3: "study",
+        4: "assay"
+    }
+    for cat in isa_tab[1:-1]:
+        count += 1
+        isa_path = '/'.join(isa_tab[:count + 1])
+        part = count + 2 == len(isa_tab) or \
+            '/'.join(isa_tab[:count + 2]) not in isa_done
+        yield from isa_triples(hdf_file, cat, isa_labels, isa_tab, count,
+                               group=isa_path not in isa_done, part=part)
+        isa_done.add(isa_path)
+        catalog += (cat + "/")
+    yield from hdf_triples(hdf_file, dataset, catalog, isa_tab, identifier)
+    subject = rdflib.URIRef(hdf_file + "#" + dataset)
+    for attr, attr_value in attrs.items():
+        predicate = rdflib.URIRef(get_namespaces()[1] + attr.replace(" ",  "-"))
+        for value in attr_value:
+            yield (subject, predicate, rdflib.Literal(value))
+
+
+@profiled
+def export_ntriples(hdf_file, rdf_file=None, quads=False, compress=False):
+    """Write the triples of an HDF5 file as N-Triples or N-Quads while
+    walking the HDF5 file. No graph is kept in memory, every triple is
+    written as soon as it is generated.
+
+    Arguments:
+        hdf_file: HDF5 file to generate the triples from.
+
+    Keyword Arguments:
+        rdf_file: Output file, None uses the HDF5 file name with
+        .nt or .nq and .gz when compressed. (default: {None})
+        quads: Write N-Quads with the HDF5 file as graph name.
+        (default: {False})
+        compress: Write a gzip compressed file. (default: {False})
+
+    Returns:
+        Path of the written file.
+    """
+    if rdf_file is None:
+        rdf_file = hdf_file.split('/')[-1] + (".nq" if quads else ".nt")
+        rdf_file += ".gz" if compress else ""
+    hdf_uri = pathlib.Path(os.path.abspath(hdf_file)).as_uri()
+    end = " " + rdflib.URIRef(hdf_uri).n3() + " .\n" if quads else " .\n"
+    interned = {}
+    isa_done = set()
+    opener = gzip.open if compress else open
+    with opener(rdf_file, 'wt', encoding='utf-8') as rdfile, \
+            h5py.File(hdf_file, 'r') as f:
+        tables = f.get(ATTRIBUTES_GROUP)
+        for dataset, dset in h5py_dataset_iterator(f):
+            attrs = read_attributes(dset, tables)
+            for s, p, o in dataset_triples(
+                    hdf_uri, dataset, attrs, uuid.uuid4().urn[9:], isa_done):
+                if p not in interned:
+                    interned[p] = p.n3()
+                rdfile.write(s.n3() + " " + interned[p] + " " + o.n3() + end)
+    return rdf_file
+
+
+@profiled
+def generate_rdf(hdf_file, incremental=True, workers=None):
+    """Generate an RDF file based on an HDF5 file.
+
+    The exported datasets and a hash of their attributes are kept in a
+    state file next to the RDF file. On the next run only the triples
+    of new datasets are appended to the RDF file. The RDF file is
+    parsed and rewritten when datasets were changed and regenerated
+    when datasets were removed.
+
+    Arguments:
+        hdf_file: HDF5 file to generate an RDF from.
+
+    Keyword Arguments:
+        incremental: Only export new or changed datasets. When False the
+        RDF file is regenerated from scratch. (default: {True})
+        workers: Generate the triples in shards by this number of worker
+        processes, see write_rdf_shards. 0 uses all CPUs and None
+        generates the triples in this process. (default: {None})
+    """
+    rdf_file = hdf_file.split('/')[-1] + ".rdf"
+    state_file = rdf_file + ".state.json"
+    state = {'datasets': {}, 'isa': []}
+    if os.path.isfile(rdf_file):
+        print(hdf_file.split('/')[-1] + ".rdf already exists!")
+        if incremental and os.path.isfile(state_file):
+            with open(state_file) as statefile:
+                state = json.load(statefile)
+        else:
+            incremental = False
+    else:
+        print("Making RDF file...")
+        incremental = False
+    hdf_catalog = load_catalog(hdf_file)
+    exported = state['datasets']
+    isa_done = set(state['isa'])
+    new = []
+    changed = []
+    for dataset, info in hdf_catalog['datasets'].items():
+        attr_hash = hashlib.sha1(json.dumps(
+            info['attrs'], sort_keys=True).encode('utf-8')).hexdigest()
+        if dataset not in exported:
+            new.append(dataset)
+            exported[dataset] = {'identifier': uuid.uuid4().urn[9:]}
+        elif exported[dataset]['hash'] != attr_hash:
+            changed.append(dataset)
+        else:
+            print(dataset, "is already in RDF")
+        exported[dataset]['hash'] = attr_hash
+    removed = [d for d in exported if d not in hdf_catalog['datasets']]
+    if incremental and not (new or changed or removed):
+        print("Finished!")
+        return
+    if removed:
+        # The ISA triples of the removed datasets are shared with other
+        # datasets, so the RDF file is regenerated with the same identifiers.
+        incremental = False
+        new = list(hdf_catalog['datasets'])
+        changed = []
+        isa_done = set()
+    g = rdflib.Graph()
+    if incremental and (changed or removed):
+        with profile_stage('generate_rdf.parse'):
+            g.parse(rdf_file, format='turtle')
+    get_namespaces(g)
+    outdated = set(changed)
+    for subject in set(g.subjects()):
+        if subject.split('#')[-1] in outdated:
+            g.remove((subject, None, None))
+    for dataset in removed:
+        del exported[dataset]
+    if workers is not None:
+        jobs = [
+            (dataset, hdf_catalog['datasets'][dataset]['attrs'],
+             exported[dataset]['identifier'])
+            for dataset in new + changed
+        ]
+        with profile_stage('generate_rdf.triples'):
+            write_rdf_shards(hdf_file, rdf_file, g, jobs, isa_done, workers or None,
+                             append=incremental and not (changed or removed))
+    else:
+        _write_rdf(hdf_file, rdf_file, g, new + changed, hdf_catalog, exported,
+                   isa_done, append=incremental and not (changed or removed))
+    profile_bytes('generate_rdf.serialize', os.path.getsize(rdf_file))
+    state['isa'] = sorted(isa_done)
+    with open(state_file, 'w') as statefile:
+        json.dump(state, statefile)
+    print("Finished!")
+
+
+def _write_rdf(hdf_file, rdf_file, g, datasets, hdf_catalog, exported, isa_done,
+               append):
+    """Add the triples of datasets to the graph and write the RDF file
+    and its index, see generate_rdf.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        rdf_file: Path of the RDF file.
+        g: Graph with the triples to keep.
+        datasets: Names of the datasets to add.
+        hdf_catalog: Catalog of the HDF5 file.
+        exported: Dictionary with the identifier per dataset.
+        isa_done: Set of group paths for which the ISA triples were generated.
+        append: Append the new triples to the RDF file instead of
+        rewriting it.
+    """
+    with profile_stage('generate_rdf.triples'):
+        for dataset in datasets:
+            for triple in dataset_triples(
+                    hdf_file, dataset, hdf_catalog['datasets'][dataset]['attrs'],
+                    exported[dataset]['identifier'], isa_done):
+                g.add(triple)
+    if append:
+        stamp = _file_stamp(rdf_file)
+        with profile_stage('generate_rdf.serialize'), open(rdf_file, 'a') as rdfile:
+            rdfile.write(g.serialize(format="turtle"))
+        update_rdf_index(rdf_file, g, stamp)
+    else:
+        with profile_stage('generate_rdf.serialize'):
+            g.serialize(destination=rdf_file, format="turtle")
+        build_rdf_index(rdf_file, g)
+
+
+def write_rdf_shards(hdf_file, rdf_file, g, jobs, isa_done, workers=None,
+                     append=False):
+    """Generate the triples of datasets in worker processes and merge
+    them into the RDF file and its index.
+
+    The datasets are split into shards by top-level group and large
+    groups into runs of datasets, see split_rdf_jobs. Every worker
+    serializes the dataset triples of its shard as Turtle; the shards are
+    written one after another, like the appended triples of generate_rdf.
+    Groups are shared by shards, so the ISA triples are merged and
+    written once after the shards.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        rdf_file: Path of the RDF file.
+        g: Graph with the triples to keep, written before the shards.
+        jobs: List of (dataset, attributes, identifier) tuples.
+        isa_done: Set of group paths for which the ISA triples were generated.
+        The group paths of the datasets are added to the set.
+
+    Keyword Arguments:
+        workers: Number of worker processes, None uses all CPUs.
+        (default: {None})
+        append: Append the shards to the RDF file instead of rewriting it.
+        (default: {False})
+    """
+    shards = split_rdf_jobs(jobs, isa_done, 4 * (workers or os.cpu_count() or 1))
+    stamp = _file_stamp(rdf_file) if append else None
+    with _rdf_index(rdf_file, rebuild=not append) as db:
+        indexed = not append or \
+            db.execute("SELECT mtime, size FROM stamp").fetchone() == stamp
+        with open(rdf_file, 'a' if append else 'w') as rdfile, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            if len(g):
+                rdfile.write(g.serialize(format="turtle"))
+                _insert_triples(db, g)
+            isa = rdflib.Graph()
+            get_namespaces(isa)
+            for text, rows, isa_triples in pool.map(
+                    _rdf_shard, [hdf_file] * len(shards),
+                    [shard for shard, skip in shards], [skip for shard, skip in shards]):
+                rdfile.write(text)
+                if indexed:
+                    db.executemany("INSERT INTO triples VALUES (?, ?, ?, ?)", rows)
+                for triple in isa_triples:
+                    isa.add(triple)
+            if len(isa):
+                rdfile.write(isa.serialize(format="turtle"))
+                if indexed:
+                    _insert_triples(db, isa)
+        if not indexed:
+            db.execute("DELETE FROM triples")
+            _insert_triples(db, rdflib.Graph().parse(rdf_file, format='turtle'))
+        _stamp_rdf_index(db, rdf_file)
+
+
+def split_rdf_jobs(jobs, isa_done, count):
+    """Split datasets into shards by top-level group. Groups with more
+    datasets than a shard holds are split into runs of datasets.
+    The ISA triples of a group are generated by the first shard with a
+    dataset in the group, the other shards skip them.
+
+    Arguments:
+        jobs: List of (dataset, attributes, identifier) tuples.
+        isa_done: Set of group paths for which the ISA triples were generated.
+        The group paths of the datasets are added to the set.
+        count: Number of shards to aim for.
+
+    Returns:
+        List of (jobs, group paths to skip) tuples.
+    """
+    size = max(1, -(-len(jobs) // count))
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job[0].split('/')[1], []).append(job)
+    shards = []
+    for group in groups.values():
+        for start in range(0, len(group), size):
+            shard = group[start:start + size]
+            paths = set()
+            for dataset, attrs, identifier in shard:
+                isa_tab = dataset.split('/')
+                paths.update('/'.join(isa_tab[:n]) for n in range(2, len(isa_tab)))
+            shards.append((shard, paths & isa_done))
+            isa_done |= paths
+    return shards
+
+
+def _rdf_shard(hdf_file, jobs, isa_done):
+    """Generate the triples of a shard, see write_rdf_shards.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        jobs: List of (dataset, attributes, identifier) tuples.
+        isa_done: Set of group paths to skip.
+
+    Returns:
+        Tuple of the dataset triples as Turtle, their query index rows
+        and the list of ISA triples.
+    """
+    g = rdflib.Graph()
+    get_namespaces(g)
+    isa = set()
+    subjects = {rdflib.URIRef(hdf_file + "#" + dataset) for dataset, attrs, identifier in jobs}
+    for dataset, attrs, identifier in jobs:
+        for triple in dataset_triples(hdf_file, dataset, attrs, identifier, isa_done):
+            if triple[0] in subjects:
+                g.add(triple)
+            else:
+                isa.add(triple)
+    return g.serialize(format="turtle"), list(_triple_rows(g)), list(isa)
+
+
+@profiled
+def delete_groups(hdf_file, groups_to_delete):
+    """Delete specific datasets based on user input.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        groups_to_delete: A list of groups to delete from the HDF5 file.
+    """
+    with open_hdf(hdf_file) as f:
+        sources = read_sources(f)
+        for group_name in groups_to_delete:
+            if group_name not in f:
+                print(group_name, "not found")
+                continue
+            _delete_object(f, group_name)
+            prefix = _absolute_name(group_name).rstrip('/')
+            for name in list(sources):
+                if name == prefix or name.startswith(prefix + '/'):
+                    del sources[name]
+            print(group_name, "deleted!")
+        _prune_content(f)
+        write_sources(f, sources)
+
+
+@profiled
+def match_paths(hdf_file, patterns):
+    """Expand path patterns with the catalog of an HDF5 file.
+    A pattern with the wildcards *, ? or [ is matched as a glob one path
+    segment at a time, so it only matches paths of the same depth and *
+    does not match a /. Any other pattern matches the path and everything
+    below it. Patterns that match nothing are reported. Matches below
+    another match are left out because deleting the parent removes them
+    as well.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        patterns: List of glob or path patterns.
+
+    Returns:
+        Tuple of the sorted list of matched paths and the storage size
+        in bytes of all datasets at or below these paths.
+    """
+    catalog = load_catalog(hdf_file)
+    paths = sorted(list(catalog['groups']) + list(catalog['datasets']))
+    datasets = sorted(catalog['datasets'])
+    matches = set()
+    for pattern in patterns:
+        pattern = '/' + pattern.strip('/')
+        wildcard = min(
+            [pattern.find(c) for c in '*?[' if c in pattern] or [len(pattern)])
+        literal = pattern[:wildcard]
+        start = bisect.bisect_left(paths, literal)
+        stop = bisect.bisect_left(paths, literal + '\U0010ffff')
+        if wildcard == len(pattern):
+            found = [p for p in paths[start:stop]
+                     if p == pattern or p.startswith(pattern + '/')]
+        else:
+            parts = pattern.split('/')
+            found = [
+                p for p in paths[start:stop]
+                if p.count('/') == len(parts) - 1 and all(
+                    fnmatch.fnmatchcase(segment, part)
+                    for segment, part in zip(p.split('/'), parts))
+            ]
+        if not found:
+            print(pattern, "does not match any group or dataset")
+        matches.update(found)
+    selected = []
+    for path in sorted(matches, key=lambda p: (p.count('/'), p)):
+        parts = path.split('/')
+        if not any('/'.join(parts[:i]) in matches for i in range(2, len(parts))):
+            selected.append(path)
+    nbytes = 0
+    for path in selected:
+        start = bisect.bisect_left(datasets, path)
+        stop = bisect.bisect_left(datasets, path + '/\U0010ffff')
+        nbytes += sum(
+            catalog['datasets'][d]['storage'] for d in datasets[start:stop]
+            if d == path or d.startswith(path + '/'))
+    return sorted(selected), nbytes
+
+
+def delete_matching(hdf_file, patterns, dry_run=False):
+    """Delete all groups and datasets that match path patterns
+    in a single session, see match_paths.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        patterns: List of glob or path patterns.
+
+    Keyword Arguments:
+        dry_run: Only report the matches without deleting them.
+        (default: {False})
+
+    Returns:
+        List of matched paths.
+    """
+    paths, nbytes = match_paths(hdf_file, patterns)
+    if dry_run:
+        for path in paths:
+            print(path)
+        print("{} objects match, {:.1f} MB of datasets".format(
+            len(paths), nbytes / 1e6))
+    else:
+        delete_groups(hdf_file, paths)
+        print("{} objects deleted, {:.1f} MB of datasets".format(
+            len(paths), nbytes / 1e6))
+    return paths
+
+
+def _delete_object(f, name):
+    """Delete a group or dataset together with its offsets
+    and attribute table.
+
+    Arguments:
+        f: Opened HDF5 file.
+        name: Name of the group or dataset.
+    """
+    del f[name]
+    for companion in [OFFSETS_GROUP, ATTRIBUTES_GROUP, PYRAMIDS_GROUP]:
+        if companion + '/' + name.strip('/') in f:
+            del f[companion + '/' + name.strip('/')]
+
+
+def open_hdf(hdf_file, mode='a'):
+    """Open an HDF5 file for writing. A new file is created with
+    persistent free-space tracking, so the space of deleted objects
+    is reused by later writes instead of growing the file.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Keyword Arguments:
+        mode: 'a' to create or append, 'w' to replace. (default: {'a'})
+
+    Returns:
+        The opened HDF5 file.
+    """
+    if mode == 'a' and os.path.exists(hdf_file):
+        return h5py.File(hdf_file, mode, libver=LIBVER)
+    return h5py.File(hdf_file, 'w' if mode == 'w' else 'w-', libver=LIBVER,
+                     fs_strategy=FS_STRATEGY, fs_persist=True)
+
+
+@profiled
+def repack(hdf_file, chunks=None, compression=None, compression_opts=None):
+    """Copy all live objects into a new HDF5 file and replace the
+    original file with it to give the space of deleted objects back.
+    Datasets are copied chunk by chunk with H5Ocopy, hard links
+    and soft links are kept.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Keyword Arguments:
+        chunks: New chunk shape for datasets with the same number of
+        dimensions. None keeps the chunks. (default: {None})
+        compression: New compression filter, False for no compression.
+        None keeps the filters. (default: {None})
+        compression_opts: Options of the new compression filter.
+        (default: {None})
+
+    Returns:
+        Number of bytes reclaimed.
+    """
+    tmp_file = hdf_file + '.repack'
+    before = os.path.getsize(hdf_file)
+    try:
+        with h5py.File(hdf_file, 'r') as src, open_hdf(tmp_file, 'w') as dst:
+            _copy_attrs(src, dst)
+            _copy_group(src, dst, {}, chunks, compression, compression_opts)
+        os.replace(tmp_file, hdf_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    after = os.path.getsize(hdf_file)
+    reclaimed = before - after
+    print("Repacked {} from {:.1f} MB to {:.1f} MB: {:.1f} MB reclaimed".format(
+        hdf_file, before / 1e6, after / 1e6, reclaimed / 1e6))
+    return reclaimed
+
+
+def _copy_group(src, dst, copied, chunks, compression, compression_opts):
+    """Copy the members of a group, see repack.
+
+    Arguments:
+        src: Source HDF5 group.
+        dst: Destination HDF5 group.
+        copied: Dictionary with the destination name per source address
+        of hard linked objects that are already copied.
+        chunks, compression, compression_opts: See repack.
+    """
+    for key in src:
+        link = src.get(key, getlink=True)
+        if isinstance(link, (h5py.SoftLink, h5py.ExternalLink)):
+            dst[key] = link
+            continue
+        obj = src[key]
+        info = h5py.h5o.get_info(obj.id)
+        if info.addr in copied:
+            dst[key] = dst.file[copied[info.addr]]
+            continue
+        if isinstance(obj, h5py.Group):
+            _copy_attrs(obj, dst.create_group(key))
+            _copy_group(obj, dst[key], copied, chunks, compression,
+                        compression_opts)
+        elif (chunks is None and compression is None) or obj.shape in [(), None]:
+            src.copy(obj, dst, name=key)
+        else:
+            _rechunk_dataset(obj, dst, key, chunks, compression,
+                             compression_opts)
+        if info.rc > 1:
+            copied[info.addr] = dst[key].name
+
+
+def _rechunk_dataset(dset, dst, key, chunks, compression, compression_opts):
+    """Copy a dataset with a new chunk shape or compression filter,
+    see repack.
+
+    Arguments:
+        dset: Source HDF5 dataset.
+        dst: Destination HDF5 group.
+        key: Name of the new dataset.
+        chunks, compression, compression_opts: See repack.
+    """
+    if chunks is not None and len(chunks) == dset.ndim:
+        new_chunks = tuple(
+            max(1, min(c, s)) if s else c for c, s in zip(chunks, dset.shape))
+    else:
+        new_chunks = dset.chunks or True
+    if compression is None:
+        compression, compression_opts = dset.compression, dset.compression_opts
+    new = dst.create_dataset(
+        key, shape=dset.shape, dtype=dset.dtype, maxshape=dset.maxshape,
+        chunks=new_chunks, compression=compression or None,
+        compression_opts=compression_opts if compression else None,
+        shuffle=dset.shuffle
+    )
+    _copy_attrs(dset, new)
+    rows = new.chunks[0]
+    for start in range(0, dset.shape[0], rows):
+        new[start:start + rows] = dset[start:start + rows]
+
+
+def _copy_attrs(src, dst):
+    """Copy the attributes of an object with their HDF5 types.
+
+    Arguments:
+        src: Source HDF5 group or dataset.
+        dst: Destination HDF5 group or dataset.
+    """
+    for name in src.attrs:
+        dst.attrs.create(name, src.attrs[name],
+                         dtype=src.attrs.get_id(name).dtype)
+
+
+@profiled
+def image_to_hdf5(filename, f, group, chunks=True, compression='gzip',
+                  compression_opts=None, shuffle=True, strip_height=256,
+                  pyramid=False):
+    """Generate an HDF5 dataset from an image.
+
+    The image is decoded in its native dtype and stored with shape
+    (height, width, channels). Large images are copied strip by strip
+    so only one strip is held in memory at a time. The source file is
+    never modified.
+
+    Arguments:
+        filename: Filename of the image.
+        f: HDF5 file.
+        group: HDF5 group name.
+
+    Keyword Arguments:
+        chunks: Chunk shape of the dataset or True to let h5py choose.
+        (default: {True})
+        compression: Compression filter, i.e. gzip or lzf. (default: {'gzip'})
+        compression_opts: Options for the compression filter. (default: {None})
+        shuffle: Enable the shuffle filter. (default: {True})
+        strip_height: Number of rows copied per strip. (default: {256})
+        pyramid: Also store levels that are downsampled by a factor 2 per
+        level until the image fits in PYRAMID_TILE pixels, built from the
+        same strips. See read_region. (default: {False})
+
+    Returns:
+        HDF5 dataset with the image data and its checksum attribute.
+    """
+    digest = BlockDigest()
+    with Image.open(filename) as img:
+        width, height = img.size
+        dset = None
+        builder = None
+        for row, strip in _iter_image_strips(img, strip_height):
+            if dset is None:
+                dset = f.create_dataset(
+                    group + filename.split('/')[-1],
+                    shape=(height, width, strip.shape[2]),
+                    dtype=strip.dtype, chunks=chunks,
+                    compression=compression,
+                    compression_opts=compression_opts,
+                    shuffle=shuffle
+                )
+                if pyramid:
+                    builder = _PyramidBuilder(dset)
+            dset[row:row + strip.shape[0]] = strip
+            digest.update(strip)
+            if builder is not None:
+                builder.add(strip)
+    if builder is not None:
+        builder.close()
+    if dset is not None:
+        dset.attrs[CHECKSUM_ATTRIBUTE] = digest.hexdigest()
+        profile_bytes('image_to_hdf5', dset.nbytes)
+    return dset
+
+
+@profiled
+def text_to_hdf5(filename, f, group, block_size=TEXT_BLOCK_SIZE,
+                 compression='gzip', compression_opts=None, shuffle=False,
+                 index=None):
+    """Generate an HDF5 dataset from a text file.
+
+    The file is copied block by block into a resizable, chunked uint8
+    dataset, so only one block is held in memory. Byte ranges can be
+    read back with read_text_range. With an index the start offset of
+    every record is stored as well, so single records can be read
+    with read_record and read_records.
+
+    Arguments:
+        filename: Filename of the text file.
+        f: HDF5 file.
+        group: HDF5 group name.
+
+    Keyword Arguments:
+        block_size: Number of bytes per block and chunk.
+        (default: {TEXT_BLOCK_SIZE})
+        compression: Compression filter, i.e. gzip or lzf. (default: {'gzip'})
+        compression_opts: Options for the compression filter. (default: {None})
+        shuffle: Enable the shuffle filter. (default: {False})
+        index: Build a record index, 'line' for every line or 'fasta'
+        for every FASTA header line. (default: {None})
+
+    Returns:
+        HDF5 dataset with the bytes of the text file and its
+        checksum attribute.
+    """
+    dset = f.create_dataset(
+        group + filename.split('/')[-1], shape=(0,), maxshape=(None,),
+        dtype=np.uint8, chunks=(block_size,), compression=compression,
+        compression_opts=compression_opts, shuffle=shuffle
+    )
+    if index is not None:
+        offsets = _create_offsets(dset, index)
+    block = np.empty(block_size, dtype=np.uint8)
+    last_byte = 10
+    digest = BlockDigest()
+    with open(filename, 'rb') as ocf:
+        while True:
+            size = ocf.readinto(block)
+            if not size:
+                break
+            offset = dset.shape[0]
+            dset.resize((offset + size,))
+            dset[offset:offset + size] = block[:size]
+            digest.update(block[:size])
+            if index is not None:
+                _append_offsets(offsets, _record_starts(
+                    block[:size], last_byte, index, offset))
+                last_byte = block[size - 1]
+    dset.attrs[CHECKSUM_ATTRIBUTE] = digest.hexdigest()
+    profile_bytes('text_to_hdf5', dset.shape[0])
+    return dset
+
+
+def _create_offsets(dset, index):
+    """Create the record index dataset that belongs to a byte dataset.
+
+    Arguments:
+        dset: HDF5 dataset with the bytes of a text file.
+        index: The kind of record index, 'line' or 'fasta'.
+
+    Raises:
+        ValueError: The kind of record index does not exist.
+
+    Returns:
+        Empty, resizable HDF5 dataset for the record start offsets.
+    """
+    if index not in ['line', 'fasta']:
+        raise ValueError("Unknown record index: " + str(index))
+    offsets = dset.file.create_dataset(
+        OFFSETS_GROUP + dset.name, shape=(0,), maxshape=(None,),
+        dtype=np.int64, chunks=(65536,), compression='gzip'
+    )
+    offsets.attrs['index'] = index
+    return offsets
+
+
+def _record_starts(block, last_byte, index, offset):
+    """Find the record start offsets in a block of bytes.
+
+    Arguments:
+        block: numpy.ndarray of uint8 with the bytes of the block.
+        last_byte: The byte before the block, newline for the first block.
+        index: The kind of record index, 'line' or 'fasta'.
+        offset: Position of the block in the file.
+
+    Returns:
+        numpy.ndarray with the file offsets of the records in the block.
+    """
+    previous = np.empty_like(block)
+    previous[0] = last_byte
+    previous[1:] = block[:-1]
+    starts = previous == 10
+    if index == 'fasta':
+        starts &= block == ord('>')
+    return np.flatnonzero(starts) + offset
+
+
+def _append_offsets(offsets, starts):
+    """Append record start offsets to a record index dataset.
+
+    Arguments:
+        offsets: HDF5 dataset created by _create_offsets.
+        starts: numpy.ndarray with record start offsets.
+    """
+    if len(starts):
+        size = offsets.shape[0]
+        offsets.resize((size + len(starts),))
+        offsets[size:] = starts
+
+
+def read_record(dset, number):
+    """Read a single record from a dataset created by text_to_hdf5
+    with a record index.
+
+    Arguments:
+        dset: HDF5 dataset with the bytes of a text file.
+        number: Number of the record, starting at 0.
+
+    Returns:
+        The bytes of the record.
+    """
+    return read_records(dset, number, number + 1)[0]
+
+
+def read_records(dset, start, stop):
+    """Read a range of records from a dataset created by text_to_hdf5
+    with a record index. Only the chunks that hold the records are read.
+
+    Arguments:
+        dset: HDF5 dataset with the bytes of a text file.
+        start: Number of the first record, starting at 0.
+        stop: Number of the record after the last record.
+
+    Raises:
+        KeyError: The dataset has no record index.
+        IndexError: The record range is outside the index.
+
+    Returns:
+        List with the bytes of every record.
+    """
+    offsets = dset.file[OFFSETS_GROUP + dset.name]
+    if not 0 <= start < stop <= offsets.shape[0]:
+        raise IndexError("Records {} to {} are not in {}".format(
+            start, stop, dset.name))
+    bounds = list(offsets[start:stop + 1])
+    if len(bounds) == stop - start:
+        bounds.append(dset.shape[0])
+    data = read_text_range(dset, bounds[0], bounds[-1])
+    return [
+        data[first - bounds[0]:last - bounds[0]]
+        for first, last in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def read_text_range(dset, start=0, stop=None):
+    """Read a byte range from a dataset created by text_to_hdf5.
+    Only the chunks that hold the range are read.
+
+    Arguments:
+        dset: HDF5 dataset with the bytes of a text file.
+
+    Keyword Arguments:
+        start: First byte to read. (default: {0})
+        stop: Byte after the last byte to read, None reads until the end.
+        (default: {None})
+
+    Returns:
+        The bytes in the range.
+    """
+    return dset[start:stop].tobytes()
+
+
+def open_dataset(hdf_file, name, cache_size=CHUNK_CACHE_SIZE,
+                 prefetch=PREFETCH_CHUNKS):
+    """Open a dataset read-only as a LazyDataset.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+        name: Name of the dataset.
+
+    Keyword Arguments:
+        cache_size: Chunk cache size in bytes. (default: {CHUNK_CACHE_SIZE})
+        prefetch: Chunks read ahead during a sequential scan.
+        (default: {PREFETCH_CHUNKS})
+
+    Returns:
+        The LazyDataset, the HDF5 file stays open while it is used.
+    """
+    return LazyDataset(h5py.File(hdf_file, 'r')[name], cache_size, prefetch)
+
+
+class LazyDataset:
+    """Lazy, sliceable read handle of an HDF5 dataset.
+
+    Contiguous datasets without filters are memory mapped at their offset
+    in the file, slicing them returns numpy views without reading or
+    copying anything. Chunked datasets are read one chunk at a time
+    into an LRU chunk cache. A selection inside a single chunk is a view
+    of the cached chunk, and when the chunks along the first axis are
+    read in order the next prefetch chunks are read ahead in one call.
+    Variable length datasets are read from h5py directly.
+
+    The handle reads the file as it is; do not modify the dataset
+    while the handle is in use.
+
+    Arguments:
+        dset: HDF5 dataset.
+
+    Keyword Arguments:
+        cache_size: Chunk cache size in bytes. (default: {CHUNK_CACHE_SIZE})
+        prefetch: Chunks read ahead during a sequential scan.
+        (default: {PREFETCH_CHUNKS})
+    """
+
+    def __init__(self, dset, cache_size=CHUNK_CACHE_SIZE, prefetch=PREFETCH_CHUNKS):
+        self.dset = dset
+        self.name = dset.name
+        self.file = dset.file
+        self.attrs = dset.attrs
+        self.shape = dset.shape
+        self.dtype = dset.dtype
+        self.ndim = dset.ndim
+        self.chunks = dset.chunks
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.cache = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.last_rows = {}
+        self.hits = 0
+        self.misses = 0
+        self.memmap = _memmap_dataset(dset)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if self.memmap is not None:
+            return self.memmap[key]
+        box = None
+        if self.chunks is not None and self.dtype.kind != 'O' and self.ndim:
+            box = _selection_box(key, self.shape)
+        if box is None:
+            return self.dset[key]
+        starts, stops, residual = box
+        if any(start >= stop for start, stop in zip(starts, stops)):
+            return self.dset[key]
+        first = tuple(start // size for start, size in zip(starts, self.chunks))
+        last = tuple((stop - 1) // size for stop, size in zip(stops, self.chunks))
+        if first == last:
+            chunk = self._chunk(first)
+            local = tuple(
+                slice(start - index * size, stop - index * size)
+                for start, stop, index, size in zip(starts, stops, first, self.chunks))
+            return chunk[local][residual]
+        block = np.empty([stop - start for start, stop in zip(starts, stops)], self.dtype)
+        for index in np.ndindex(*[b - a + 1 for a, b in zip(first, last)]):
+            index = tuple(a + i for a, i in zip(first, index))
+            chunk = self._chunk(index)
+            lows = [max(start, i * size) for start, i, size in zip(starts, index, self.chunks)]
+            highs = [min(stop, (i + 1) * size) for stop, i, size in zip(stops, index, self.chunks)]
+            block[tuple(slice(lo - s, hi - s) for lo, hi, s in zip(lows, highs, starts))] = \
+                chunk[tuple(slice(lo - i * size, hi - i * size)
+                            for lo, hi, i, size in zip(lows, highs, index, self.chunks))]
+        return block[residual]
+
+    def blocks(self, rows=None):
+        """Scan the dataset along the first axis.
+
+        Keyword Arguments:
+            rows: Number of rows per block, None uses the chunk rows.
+            (default: {None})
+
+        Returns:
+            Generator of (first row, numpy.ndarray) tuples.
+        """
+        rows = rows or (self.chunks[0] if self.chunks else PREVIEW_SIZE)
+        for start in range(0, self.shape[0], rows):
+            yield start, self[start:start + rows]
+
+    def _chunk(self, index):
+        """Get a chunk from the cache or read it, reading ahead on a
+        sequential scan."""
+        chunk = self.cache.get(index)
+        if chunk is not None:
+            self.cache.move_to_end(index)
+            self.hits += 1
+            self.last_rows[index[1:]] = index[0]
+            return chunk
+        self.misses += 1
+        count = 1
+        if self.last_rows.get(index[1:]) == index[0] - 1:
+            count += self.prefetch
+        size = self.chunks[0]
+        stop = min((index[0] + count) * size, self.shape[0])
+        region = tuple(
+            slice(i * s, min((i + 1) * s, n))
+            for i, s, n in zip(index[1:], self.chunks[1:], self.shape[1:]))
+        data = self.dset[(slice(index[0] * size, stop),) + region]
+        data.flags.writeable = False
+        for row in range(size, data.shape[0], size):
+            self._store((index[0] + row // size,) + index[1:], data[row:row + size])
+        self._store(index, data[:size])
+        self.last_rows[index[1:]] = index[0]
+        return data[:size]
+
+    def _store(self, index, chunk):
+        """Add a chunk to the cache and evict the least recently used."""
+        if index in self.cache:
+            return
+        self.cache[index] = chunk
+        self.cached_bytes += chunk.nbytes
+        while self.cached_bytes > self.cache_size and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+
+
+def _memmap_dataset(dset):
+    """Memory map a contiguous dataset without filters.
+
+    Arguments:
+        dset: HDF5 dataset.
+
+    Returns:
+        Read-only numpy.memmap or None when the dataset can not be mapped.
+    """
+    if dset.chunks is not None or dset.compression or dset.dtype.kind == 'O' \
+            or dset.dtype.hasobject or not dset.size or dset.file.driver != 'sec2' \
+            or dset.id.get_create_plist().get_external_count():
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode='r',
+                     offset=offset, shape=dset.shape)
+
+
+def _selection_box(key, shape):
+    """Split a selection into the box of elements to read and the
+    selection within that box.
+
+    Arguments:
+        key: Integer, slice, Ellipsis or tuple of those.
+        shape: Shape of the dataset.
+
+    Returns:
+        Tuple of the box starts, box stops and the selection within
+        the box, or None for other selections.
+    """
+    key = key if isinstance(key, tuple) else (key,)
+    ellipsis = [i for i, item in enumerate(key) if item is Ellipsis]
+    if ellipsis:
+        at = ellipsis[0]
+        key = key[:at] + (slice(None),) * (len(shape) - len(key) + 1) + key[at + 1:]
+    if len(key) > len(shape):
+        return None
+    key = key + (slice(None),) * (len(shape) - len(key))
+    starts, stops, residual = [], [], []
+    for item, size in zip(key, shape):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(size)
+            if step < 1:
+                return None
+            starts.append(start)
+            stops.append(max(start, stop))
+            residual.append(slice(None, None, step))
+        elif isinstance(item, (int, np.integer)):
+            index = int(item) + size if item < 0 else int(item)
+            if not 0 <= index < size:
+                return None
+            starts.append(index)
+            stops.append(index + 1)
+            residual.append(0)
+        else:
+            return None
+    return starts, stops, tuple(residual)
+
+
+@profiled
+def build_pyramid(dset, strip_height=256):
+    """Store the downsampled levels of an image dataset that is
+    already in the HDF5 file, see image_to_hdf5.
+
+    Arguments:
+        dset: HDF5 image dataset.
+
+    Keyword Arguments:
+        strip_height: Number of rows read per strip. (default: {256})
+
+    Returns:
+        List with the image dataset followed by its levels.
+    """
+    builder = _PyramidBuilder(dset)
+    for row in range(0, dset.shape[0], strip_height):
+        builder.add(dset[row:row + strip_height])
+    builder.close()
+    return pyramid_levels(dset)
+
+
+def pyramid_levels(dset):
+    """Get the stored levels of an image dataset.
+
+    Arguments:
+        dset: HDF5 image dataset.
+
+    Returns:
+        List with the image dataset followed by its downsampled levels.
+    """
+    levels = [dset]
+    group = dset.file.get(PYRAMIDS_GROUP + dset.name)
+    while group is not None and str(len(levels)) in group:
+        levels.append(group[str(len(levels))])
+    return levels
+
+
+def read_region(dset, top=0, left=0, height=None, width=None, level=0):
+    """Read a region of an image at a zoom level. Only the chunks of
+    the nearest stored level that overlap the region are read, a level
+    that is not stored is downsampled from that region.
+
+    Arguments:
+        dset: HDF5 image dataset.
+
+    Keyword Arguments:
+        top: First row of the region in full resolution pixels. (default: {0})
+        left: First column of the region in full resolution pixels. (default: {0})
+        height: Number of rows in full resolution pixels, None reads to
+        the bottom of the image. (default: {None})
+        width: Number of columns in full resolution pixels, None reads to
+        the right side of the image. (default: {None})
+        level: Zoom level, every level halves the width and height.
+        (default: {0})
+
+    Returns:
+        numpy.ndarray of shape (rows, columns, channels).
+    """
+    height = dset.shape[0] - top if height is None else height
+    width = dset.shape[1] - left if width is None else width
+    levels = pyramid_levels(dset)
+    stored = min(level, len(levels) - 1)
+    scale = 2 ** stored
+    region = levels[stored][
+        top // scale:-(-(top + height) // scale),
+        left // scale:-(-(left + width) // scale)
+    ]
+    for _ in range(stored, level):
+        region = _downsample(region)
+    return region
+
+
+class _PyramidBuilder:
+    """Write the downsampled levels of an image strip by strip.
+    Every level halves the rows and columns with a 2x2 mean, a row
+    without a partner is kept until the next strip arrives.
+
+    Arguments:
+        dset: HDF5 image dataset, its levels are stored in PYRAMIDS_GROUP.
+    """
+
+    def __init__(self, dset):
+        height, width, channels = dset.shape
+        group = dset.file.require_group(PYRAMIDS_GROUP + dset.name)
+        self.levels = []
+        while max(height, width) > PYRAMID_TILE:
+            height, width = -(-height // 2), -(-width // 2)
+            self.levels.append(group.create_dataset(
+                str(len(self.levels) + 1), shape=(height, width, channels),
+                dtype=dset.dtype,
+                chunks=(min(PYRAMID_TILE, height), min(PYRAMID_TILE, width), channels),
+                compression=dset.compression,
+                compression_opts=dset.compression_opts, shuffle=dset.shuffle
+            ))
+        self.carry = [None] * len(self.levels)
+        self.buffers = [[] for _ in self.levels]
+        self.rows = [0] * len(self.levels)
+
+    def add(self, strip, level=0):
+        """Add the next rows of a level and downsample them."""
+        if level == len(self.levels):
+            return
+        if self.carry[level] is not None:
+            strip = np.concatenate([self.carry[level], strip])
+            self.carry[level] = None
+        if strip.shape[0] % 2:
+            self.carry[level] = strip[-1:]
+            strip = strip[:-1]
+        if strip.shape[0]:
+            down = _downsample(strip)
+            self._write(level, down)
+            self.add(down, level + 1)
+
+    def close(self):
+        """Downsample the remaining rows and write all levels."""
+        for level in range(len(self.levels)):
+            if self.carry[level] is not None:
+                last = self.carry[level]
+                self.carry[level] = None
+                down = _downsample(np.concatenate([last, last]))
+                self._write(level, down)
+                self.add(down, level + 1)
+            self._flush(level)
+
+    def _write(self, level, rows):
+        self.buffers[level].append(rows)
+        if sum(b.shape[0] for b in self.buffers[level]) >= self.levels[level].chunks[0]:
+            self._flush(level)
+
+    def _flush(self, level):
+        if not self.buffers[level]:
+            return
+        rows = np.concatenate(self.buffers[level])
+        self.buffers[level] = []
+        start = self.rows[level]
+        self.levels[level][start:start + rows.shape[0]] = rows
+        self.rows[level] += rows.shape[0]
+
+
+def _downsample(region):
+    """Halve the rows and columns of an image region with a 2x2 mean.
+    An odd last row or column is repeated.
+
+    Arguments:
+        region: numpy.ndarray of shape (rows, columns, channels).
+
+    Returns:
+        numpy.ndarray with the same dtype.
+    """
+    if region.shape[0] % 2:
+        region = np.concatenate([region, region[-1:]], axis=0)
+    if region.shape[1] % 2:
+        region = np.concatenate([region, region[:, -1:]], axis=1)
+    work = np.float32 if region.dtype.itemsize <= 2 else np.float64
+    total = region[0::2, 0::2].astype(work) + region[1::2, 0::2] \
+        + region[0::2, 1::2] + region[1::2, 1::2]
+    down = total / 4
+    if np.issubdtype(region.dtype, np.integer):
+        down = np.rint(down)
+    return down.astype(region.dtype)
+
+
+def _iter_image_strips(img, strip_height):
+    """Decode an image into strips of rows.
+
+    Uncompressed images are read straight from the file at the strip
+    offsets. All other images, including LZW or deflate compressed TIFF
+    files, are decoded whole and sliced, so their peak memory use is the
+    size of the decoded image.
+
+    Arguments:
+        img: Opened PIL image.
+        strip_height: Maximum number of rows per strip.
+
+    Returns:
+        Generator of (first row, numpy.ndarray of shape (rows, width, channels)).
+    """
+    width, height = img.size
+    raw = img.mode not in ('1', 'P') and all(
+        tile[0] == 'raw' and tile[3][0] == img.mode
+        and tile[1][0] == 0 and tile[1][2] == width
+        and len(tile[3]) > 2 and tile[3][1] == 0 and tile[3][2] == 1
+        for tile in img.tile
+    )
+    if raw and img.filename:
+        pixel = np.asarray(Image.new(img.mode, (1, 1)))
+        pixel = pixel.reshape(1, 1, -1)
+        line_size = width * pixel.nbytes
+        with open(img.filename, 'rb') as imgfile:
+            for tile in img.tile:
+                first, last = tile[1][1], tile[1][3]
+                for row in range(first, last, strip_height):
+                    rows = min(strip_height, last - row)
+                    imgfile.seek(tile[2] + (row - first) * line_size)
+                    strip = np.fromfile(
+                        imgfile, dtype=pixel.dtype,
+                        count=rows * width * pixel.shape[2]
+                    )
+                    yield row, strip.reshape(rows, width, pixel.shape[2])
+    else:
+        data = np.asarray(img)
+        data = data.reshape(height, width, -1)
+        for row in range(0, height, strip_height):
+            yield row, data[row:row + strip_height]
+
+
+def ontologies(tag):
+    """Search for ontologies based on user input.
+
+    Arguments:
+        tag: User input to find an ontology
+
+    Returns:
+        Ontology list with label, iri and description.
+    """
+    return _parse_ontologies(tag, lookup('ontology', str(tag)))
+
+
+def _parse_ontologies(tag, searchonto):
+    """Create the ontology list from an OLS search response.
+
+    Arguments:
+        tag: User input to find an ontology
+        searchonto: The OLS search response.
+
+    Returns:
+        Ontology list with label, iri and description.
+    """
+    foundontologies = {}
+    ontolist = []
+    for i in range(0, len(searchonto['response']['docs'])):
+        try:
+            iri = searchonto['response']['docs'][i]['iri']
+            label = searchonto['response']['docs'][i]['label'].lower()
+            description = searchonto['response']['docs'][i]['description'][0]
+            if iri not in ontolist:
+                if tag in label:
+                    if iri not in ontolist:
+                        foundontologies[label] = iri
+                        ontolist.append((label, description, iri))
+        except KeyError:
+            pass
+    return ontolist
+
+
+@profiled
+def query_rdf(rdf_file, predicate, value=None, match='substring'):
+    """Query the generated RDF file based on a predicate and optionally
+    a value. The query uses the index of the RDF file, see search_rdf_index.
+    When a single dataset matches, the dataset is printed as well.
+
+    Arguments:
+        rdf_file: Path of the RDF file to query.
+        predicate: The entered predicate used to query the RDF.
+
+    Keyword Arguments:
+        value: The value of the predicate. (default: {None})
+        match: How the predicate and value are matched, exact, prefix
+        or substring. (default: {'substring'})
+
+    Returns:
+        List with the paths of the matching datasets.
+    """
+    names = []
+    for s, p, o in search_rdf_index(rdf_file, predicate, value, match):
+        name = s.split('#')[-1]
+        print(p, "======", o)
+        print("Available in file", name)
+        print()
+        if name not in names:
+            names.append(name)
+    if len(names) == 1:
+        with h5py.File(rdf_file[:-4], 'r') as f:
+            dset = LazyDataset(f[names[0]])
+            if dset.ndim and dset.shape[0] > PREVIEW_SIZE:
+                print(dset[:PREVIEW_SIZE], "...")
+            else:
+                print(dset[:])
+    return names
+
+
+@profiled
+def build_rdf_index(rdf_file, g=None):
+    """Build the query index of an RDF file.
+    The index is an SQLite database next to the RDF file with
+    the triples indexed by predicate name and object value.
+
+    Arguments:
+        rdf_file: Path of the Turtle or N-Triples file.
+
+    Keyword Arguments:
+        g: Graph with the content of the RDF file, None parses the file.
+        (default: {None})
+    """
+    if g is None:
+        g = rdflib.Graph().parse(rdf_file, format=_rdf_format(rdf_file))
+    with _rdf_index(rdf_file, rebuild=True) as db:
+        _insert_triples(db, g)
+        _stamp_rdf_index(db, rdf_file)
+
+
+@profiled
+def update_rdf_index(rdf_file, triples, stamp):
+    """Add new triples to the query index of an RDF file.
+    The index is rebuilt when it does not match the RDF file
+    from before the triples were added.
+
+    Arguments:
+        rdf_file: Path of the RDF file.
+        triples: Iterable of the triples that were added to the RDF file.
+        stamp: Stamp of the RDF file before the triples were added,
+        see _file_stamp.
+    """
+    with _rdf_index(rdf_file) as db:
+        if db.execute("SELECT mtime, size FROM stamp").fetchone() == stamp:
+            _insert_triples(db, triples)
+            _stamp_rdf_index(db, rdf_file)
+            return
+    build_rdf_index(rdf_file)
+
+
+def _file_stamp(rdf_file):
+    """Get the modification time and size of a file as stored in the
+    stamp of the query index.
+
+    Arguments:
+        rdf_file: Path of the RDF file.
+
+    Returns:
+        Tuple of the modification time in nanoseconds and the size.
+    """
+    stat = os.stat(rdf_file)
+    return stat.st_mtime_ns, stat.st_size
+
+
+@profiled
+def search_rdf_index(rdf_file, predicate=None, value=None, match='exact'):
+    """Find triples in an RDF file by predicate and object value.
+    The index is (re)built first when it is missing or outdated.
+
+    Arguments:
+        rdf_file: Path of the RDF file.
+
+    Keyword Arguments:
+        predicate: Predicate name or full predicate IRI. (default: {None})
+        value: Object value. (default: {None})
+        match: How the predicate and value are matched, exact, prefix
+        or substring. (default: {'exact'})
+
+    Raises:
+        ValueError: Unknown match type.
+
+    Returns:
+        List of (subject, predicate, object) tuples as strings.
+    """
+    if match not in ['exact', 'prefix', 'substring']:
+        raise ValueError("Unknown match type: " + str(match))
+    stat = os.stat(rdf_file)
+    with _rdf_index(rdf_file) as db:
+        stamp = db.execute("SELECT mtime, size FROM stamp").fetchone()
+        if stamp != (stat.st_mtime_ns, stat.st_size):
+            build_rdf_index(rdf_file)
+        where = []
+        args = []
+        for columns, term in [(('name', 'predicate'), predicate), (('object',), value)]:
+            if term is None:
+                continue
+            if match == 'exact':
+                where.append(' OR '.join(c + ' = ?' for c in columns))
+                args.extend([term] * len(columns))
+            elif match == 'prefix':
+                where.append(' OR '.join(
+                    '(' + c + ' >= ? AND ' + c + ' < ?)' for c in columns))
+                args.extend([term, term + '\U0010ffff'] * len(columns))
+            else:
+                where.append(' OR '.join('instr(' + c + ', ?) > 0' for c in columns))
+                args.extend([term] * len(columns))
+        query = "SELECT subject, predicate, object FROM triples"
+        if where:
+            query += " WHERE " + " AND ".join('(' + w + ')' for w in where)
+        return db.execute(query, args).fetchall()
+
+
+def _rdf_format(rdf_file):
+    """Get the rdflib format of an RDF file from its extension.
+
+    Arguments:
+        rdf_file: Path of the RDF file.
+
+    Returns:
+        The rdflib format name.
+    """
+    return 'nt' if rdf_file.split('.')[-1] == 'nt' else 'turtle'
+
+
+@contextlib.contextmanager
+def _rdf_index(rdf_file, rebuild=False):
+    """Open the SQLite query index of an RDF file. The changes are
+    committed and the connection is closed when the context exits.
+
+    Arguments:
+        rdf_file: Path of the RDF file.
+
+    Keyword Arguments:
+        rebuild: Remove all indexed triples. (default: {False})
+
+    Returns:
+        Context manager with the SQLite connection.
+    """
+    db = sqlite3.connect(rdf_file + ".sqlite")
+    try:
+        with db:
+            if rebuild or db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'stamp'").fetchone() is None:
+                _create_rdf_index(db)
+            yield db
+    finally:
+        db.close()
+
+
+def _create_rdf_index(db):
+    """Create the tables of the query index, existing tables are removed.
+
+    Arguments:
+        db: SQLite connection from _rdf_index.
+    """
+    db.execute("DROP TABLE IF EXISTS triples")
+    db.execute("DROP TABLE IF EXISTS stamp")
+    db.execute("CREATE TABLE triples (subject TEXT, predicate TEXT, name TEXT, object TEXT)")
+    db.execute("CREATE TABLE stamp (mtime INTEGER, size INTEGER)")
+    db.execute("CREATE INDEX triples_name ON triples (name, object)")
+    db.execute("CREATE INDEX triples_predicate ON triples (predicate)")
+    db.execute("CREATE INDEX triples_object ON triples (object)")
+
+
+def _insert_triples(db, triples):
+    """Insert triples into the query index.
+
+    Arguments:
+        db: SQLite connection from _rdf_index.
+        triples: Iterable of triples.
+    """
+    db.executemany("INSERT INTO triples VALUES (?, ?, ?, ?)", _triple_rows(triples))
+
+
+def _triple_rows(triples):
+    """Convert triples to rows of the query index.
+
+    Arguments:
+        triples: Iterable of triples.
+
+    Returns:
+        Generator of (subject, predicate, predicate name, object) tuples.
+    """
+    return (
+        (str(s), str(p), str(p).replace('#', '/').split('/')[-1], str(o))
+        for s, p, o in triples
+    )
+
+
+def _stamp_rdf_index(db, rdf_file):
+    """Store the modification time and size of the indexed RDF file.
+
+    Arguments:
+        db: SQLite connection from _rdf_index.
+        rdf_file: Path of the RDF file.
+    """
+    stat = os.stat(rdf_file)
+    db.execute("DELETE FROM stamp")
+    db.execute("INSERT INTO stamp VALUES (?, ?)", (stat.st_mtime_ns, stat.st_size))
+
+
+def search_naturalis(query):
+    """Query the naturalis specimen collection to add as attributes to an HDF.
+    
+    Arguments:
+        query: Search term to retrieve the specimen information.
+
+    Returns:
+        A dictionary containing information from the naturalis collection.
+    """
+    return _parse_naturalis(lookup('specimen', query))
+
+
+def _parse_naturalis(jnl):
+    """Create the naturalis attributes from a specimen response.
+
+    Arguments:
+        jnl: The naturalis specimen response.
+
+    Returns:
+        A dictionary containing information from the naturalis collection.
+    """
+    naturalis = {}
+    for item in jnl:
+        if item != "sourceSystem" or item != "identifications":
+            naturalis[item] = str(jnl[item])
+        if item == "identifications":
+            for subitem in jnl[item]:
+                for x in range(len(jnl[item])):
+                    for subitem in jnl[item][x]:
+                        naturalis[subitem] = str(jnl[item][x][subitem])
+    return naturalis
 
 
-def delete_groups(hdf_file, groups_to_delete):
-    """Delete specific datasets based on user input.
+@profiled
+def lookup(kind, term):
+    """Look up a term with the lookup backend.
+    Responses are kept in the lookup cache per backend, so every term
+    is only sent to the backend once per cache period.
 
     Arguments:
-        hdf_file: The HDF5 file.
-        groups_to_delete: A list of groups to delete from the HDF5 file.
+        kind: The kind of lookup, ontology or specimen.
+        term: The term to look up.
+
+    Returns:
+        The response of the backend.
     """
-    with h5py.File(hdf_file,  "a") as f:
-        for group_name in groups_to_delete:
-            del f[group_name]
-            print(group_name, "deleted!")
+    cache = get_lookup_cache()
+    backend = get_lookup_backend()
+    key = getattr(backend, 'name', type(backend).__name__) + ' ' + kind + ':' + term
+    response = cache.get(key)
+    if response is None:
+        with profile_stage('lookup.backend'):
+            if kind == 'ontology':
+                response = backend.search_ontology(term)
+            else:
+                response = backend.find_specimen(term)
+        cache.set(key, response)
+    return response
 
 
-def image_to_hdf5(filename, f, group):
-    """Generate an HDF5 dataset from an image.
+def lookup_many(kind, terms, concurrency=8):
+    """Look up many terms concurrently, see lookup.
 
     Arguments:
-        filename: Filename of the image.
-        f: HDF5 file.
-        group: HDF5 group name.
+        kind: The kind of lookup, ontology or specimen.
+        terms: The terms to look up.
+
+    Keyword Arguments:
+        concurrency: Maximum number of lookups at the same time.
+        (default: {8})
 
     Returns:
-        HDF5 dataset in numpy.ndarray from the image.
+        Dictionary with the response per term.
     """
-    img = Image.open(filename)
-    image = np.array(img.getdata()).reshape(img.size[1], img.size[0], -1)
-    data = np.array(image)
-    dset = f.create_dataset(group + filename.split('/')
-                            [-1], shape=(4, img.size[1], img.size[0], 4))
-    dset[0] = data
-    im = Image.fromarray(dset[0].astype('uint8'))
-    im.save(filename)
-    return dset
+    get_lookup_backend()
+    get_lookup_cache()
+    return asyncio.run(_lookup_many(kind, list(dict.fromkeys(terms)), concurrency))
 
 
-def ontologies(tag):
-    """Search for ontologies based on user input.
+async def _lookup_many(kind, terms, concurrency):
+    """Coroutine that runs the lookups of lookup_many in threads."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(term):
+        async with semaphore:
+            return await loop.run_in_executor(None, lookup, kind, term)
+
+    responses = await asyncio.gather(*(run(term) for term in terms))
+    return dict(zip(terms, responses))
+
+
+def ontologies_many(tags, concurrency=8):
+    """Search for the ontologies of many tags concurrently.
 
     Arguments:
-        tag: User input to find an ontology
+        tags: List of tags to find ontologies for.
+
+    Keyword Arguments:
+        concurrency: Maximum number of lookups at the same time.
+        (default: {8})
 
     Returns:
-        Ontology list with label, iri and description.
+        Dictionary with the ontology list per tag, see ontologies.
     """
-    ols = ols_client.client.OlsClient()
-    foundontologies = {}
-    ontolist = []
-    searchonto = ols.search(str(tag))
-    for i in range(0, len(searchonto['response']['docs'])):
+    responses = lookup_many('ontology', [str(tag) for tag in tags], concurrency)
+    return {tag: _parse_ontologies(tag, responses[str(tag)]) for tag in tags}
+
+
+class LookupCache:
+    """Persistent cache of lookup responses in an SQLite file.
+    Entries expire after ttl seconds and the least recently used
+    entries are removed when the cache holds more than max_entries.
+
+    Keyword Arguments:
+        path: Path of the cache file. (default: {LOOKUP_CACHE})
+        ttl: Seconds before an entry expires. (default: {LOOKUP_TTL})
+        max_entries: Maximum number of entries. (default: {10000})
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=10000):
+        self.path = path or LOOKUP_CACHE
+        self.ttl = LOOKUP_TTL if ttl is None else ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, "
+            "value TEXT, stored REAL, used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS lookups_used ON lookups (used)")
+
+    def get(self, key):
+        """Get a response from the cache.
+
+        Arguments:
+            key: The cache key.
+
+        Returns:
+            The cached response or None when missing or expired.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT value, stored FROM lookups WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.db.execute("DELETE FROM lookups WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE lookups SET used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a response in the cache.
+
+        Arguments:
+            key: The cache key.
+            value: The response, it must be JSON serializable.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self.db.execute(
+                "DELETE FROM lookups WHERE key IN (SELECT key FROM lookups "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+
+class HttpLookupBackend:
+    """Lookup backend that uses the OLS and naturalis web services.
+    All requests share a pooled HTTP session.
+
+    Keyword Arguments:
+        ols_url: URL of the OLS search service. (default: {OLS_URL})
+        naturalis_url: URL of the naturalis specimen service.
+        (default: {NATURALIS_URL})
+        pool_size: Number of pooled connections per host. (default: {16})
+    """
+
+    def __init__(self, ols_url=None, naturalis_url=None, pool_size=16):
+        self.ols_url = ols_url or OLS_URL
+        self.naturalis_url = naturalis_url or NATURALIS_URL
+        self.name = self.ols_url + ' ' + self.naturalis_url
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'accept': 'application/json',
+            'charset': 'UTF-8',
+        })
+
+    def search_ontology(self, term):
+        """Search the OLS for a term and return the JSON response."""
+        response = self.session.get(self.ols_url, params={'q': term})
+        response.raise_for_status()
+        profile_bytes('lookup.backend', len(response.content))
+        return response.json()
+
+    def find_specimen(self, query):
+        """Find a naturalis specimen and return the JSON response."""
+        response = self.session.get(self.naturalis_url + query)
+        response.raise_for_status()
+        profile_bytes('lookup.backend', len(response.content))
+        return response.json()
+
+
+class FixtureLookupBackend:
+    """Lookup backend that reads the responses from a JSON file,
+    i.e. for tests without network access. The file contains the
+    objects ontology and specimen with the response per term.
+
+    Arguments:
+        path: Path of the JSON fixture file.
+    """
+
+    def __init__(self, path):
+        self.name = 'fixture:' + os.path.abspath(path)
+        with open(path) as fixturefile:
+            self.responses = json.load(fixturefile)
+
+    def search_ontology(self, term):
+        """Return the fixture response of an ontology search."""
+        return self.responses.get('ontology', {}).get(
+            term, {'response': {'docs': []}})
+
+    def find_specimen(self, query):
+        """Return the fixture response of a specimen search."""
+        return self.responses.get('specimen', {}).get(query, {})
+
+
+_lookup_backend = None
+_lookup_cache = None
+
+
+def get_lookup_backend():
+    """Get the lookup backend. Unless set with set_lookup_backend this is
+    a FixtureLookupBackend when HDF5GENERATOR_LOOKUP_FIXTURE is set and
+    an HttpLookupBackend otherwise.
+
+    Returns:
+        The lookup backend.
+    """
+    global _lookup_backend
+    if _lookup_backend is None:
+        if os.environ.get('HDF5GENERATOR_LOOKUP_FIXTURE'):
+            _lookup_backend = FixtureLookupBackend(
+                os.environ['HDF5GENERATOR_LOOKUP_FIXTURE'])
+        else:
+            _lookup_backend = HttpLookupBackend()
+    return _lookup_backend
+
+
+def set_lookup_backend(backend):
+    """Set the lookup backend.
+
+    Arguments:
+        backend: Object with the methods search_ontology and find_specimen.
+        Its name attribute, if any, separates its responses in the cache.
+    """
+    global _lookup_backend
+    _lookup_backend = backend
+
+
+def get_lookup_cache():
+    """Get the lookup cache, see LookupCache.
+
+    Returns:
+        The lookup cache.
+    """
+    global _lookup_cache
+    if _lookup_cache is None:
+        _lookup_cache = LookupCache()
+    return _lookup_cache
+
+
+def set_lookup_cache(cache):
+    """Set the lookup cache.
+
+    Arguments:
+        cache: Object with the methods get and set.
+    """
+    global _lookup_cache
+    _lookup_cache = cache
+
+
+class HandlePool:
+    """Pool of open read-only HDF5 file handles.
+    Handles are opened in SWMR read mode when the file supports it and
+    are reused until the inode, modification time or size of the file
+    changes, so repeated queries do not pay for opening the file and
+    loading its metadata again. Open handles hold the HDF5 file lock,
+    so another process can only open the file for writing when no
+    handle is open; call close_idle regularly to release the file
+    between queries.
+
+    Keyword Arguments:
+        size: Maximum number of idle handles per file. (default: {POOL_SIZE})
+        timeout: Seconds an idle handle stays open, see close_idle.
+        (default: {POOL_IDLE})
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_IDLE):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+
+    @contextlib.contextmanager
+    def handle(self, hdf_file):
+        """Borrow a handle of an HDF5 file.
+
+        Arguments:
+            hdf_file: The HDF5 file.
+
+        Returns:
+            Context manager that gives the h5py file.
+        """
+        path = os.path.abspath(hdf_file)
+        stat = os.stat(path)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        stale = []
+        with self.lock:
+            current, handles = self.idle.get(path, (stamp, []))
+            if current != stamp:
+                stale, handles = handles, []
+            f = handles.pop()[0] if handles else None
+            self.idle[path] = (stamp, handles)
+            if f is None:
+                self.opened += 1
+            else:
+                self.reused += 1
+        for old in stale:
+            old.close()
+        if f is None:
+            f = _open_swmr(path)
         try:
-            iri = searchonto['response']['docs'][i]['iri']
-            label = searchonto['response']['docs'][i]['label'].lower()
-            description = searchonto['response']['docs'][i]['description'][0]
-            if iri not in ontolist:
-                if tag in label:
-                    if iri not in ontolist:
-                        foundontologies[label] = iri
-                        ontolist.append((label, description, iri))
-        except KeyError:
+            yield f
+        finally:
+            with self.lock:
+                current, handles = self.idle.get(path, (None, []))
+                if current == stamp and len(handles) < self.size:
+                    handles.append((f, time.monotonic()))
+                    f = None
+            if f is not None:
+                f.close()
+
+    def close_idle(self):
+        """Close the handles that were idle for more than timeout seconds."""
+        expired = []
+        deadline = time.monotonic() - self.timeout
+        with self.lock:
+            for stamp, handles in self.idle.values():
+                expired.extend(f for f, returned in handles if returned < deadline)
+                handles[:] = [(f, returned) for f, returned in handles
+                              if returned >= deadline]
+        for f in expired:
+            f.close()
+
+    def close(self):
+        """Close all idle handles."""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for stamp, handles in idle.values():
+            for f, returned in handles:
+                f.close()
+
+
+def _open_swmr(hdf_file):
+    """Open an HDF5 file read-only, in SWMR read mode when possible.
+    The handle holds the HDF5 file lock like any other reader, see
+    HandlePool.
+
+    Arguments:
+        hdf_file: The HDF5 file.
+
+    Returns:
+        The h5py file.
+    """
+    try:
+        return h5py.File(hdf_file, 'r', libver='latest', swmr=True)
+    except (OSError, ValueError):
+        return h5py.File(hdf_file, 'r')
+
+
+class ServiceStats:
+    """Thread-safe request counters of the query service: the number of
+    requests and errors, the throughput and latency percentiles per
+    operation over the last LATENCY_SAMPLES requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.ops = {}
+
+    def record(self, op, seconds, ok=True):
+        """Record a handled request.
+
+        Arguments:
+            op: Name of the operation.
+            seconds: Latency of the request.
+
+        Keyword Arguments:
+            ok: The request succeeded. (default: {True})
+        """
+        with self.lock:
+            stats = self.ops.setdefault(op, {
+                'requests': 0, 'errors': 0, 'seconds': 0.0,
+                'latencies': collections.deque(maxlen=LATENCY_SAMPLES)})
+            stats['requests'] += 1
+            stats['errors'] += not ok
+            stats['seconds'] += seconds
+            stats['latencies'].append(seconds)
+
+    def report(self):
+        """Get the counters.
+
+        Returns:
+            Dictionary with the uptime, totals and counters by operation,
+            latencies are in milliseconds.
+        """
+        with self.lock:
+            uptime = time.time() - self.start
+            report = {'uptime': uptime, 'requests': 0, 'errors': 0, 'ops': {}}
+            for op, stats in self.ops.items():
+                latencies = sorted(stats['latencies'])
+                report['requests'] += stats['requests']
+                report['errors'] += stats['errors']
+                report['ops'][op] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'requests_per_second': stats['requests'] / uptime,
+                    'mean_ms': stats['seconds'] / stats['requests'] * 1000,
+                    'p50_ms': _percentile(latencies, 0.5) * 1000,
+                    'p95_ms': _percentile(latencies, 0.95) * 1000,
+                    'p99_ms': _percentile(latencies, 0.99) * 1000,
+                    'max_ms': latencies[-1] * 1000
+                }
+            report['requests_per_second'] = report['requests'] / uptime
+        return report
+
+
+def _percentile(values, fraction):
+    """Get a percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class QueryService:
+    """Long-lived query service for HDF5 and RDF files.
+    Requests and responses are JSON objects, one per line. A request has
+    an "op" and the parameters of the operation:
+
+        ping
+        attributes: path, name (optional, all datasets when missing)
+        dataset: path, name, start and stop (optional)
+        rdf: path, predicate, value and match (optional, see search_rdf_index)
+        stats
+
+    A response has "ok" and either "result" or "error". Every connection
+    is served by its own thread; the HDF5 files are read through a
+    HandlePool whose idle handles are closed after POOL_IDLE seconds, so
+    other processes can write to the files while the service is idle.
+
+    Arguments:
+        address: Unix socket path or localhost:port.
+
+    Keyword Arguments:
+        handles: Maximum number of idle handles per file. (default: {POOL_SIZE})
+
+    Raises:
+        ValueError: The address is not a Unix socket or a loopback address.
+    """
+
+    def __init__(self, address, handles=POOL_SIZE):
+        self.address = address
+        # Lazy modules are not thread-safe while they load, load them
+        # before the handler threads start.
+        h5py.File, np.ndarray, rdflib.Graph
+        self.pool = HandlePool(handles)
+        self.stats = ServiceStats()
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response = service.handle_request(line)
+                    self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+
+        family, bind = _service_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(bind):
+                os.remove(bind)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = type('Server', (socketserver.ThreadingTCPServer,),
+                                {'address_family': family, 'allow_reuse_address': True})
+        self.server = server_class(bind, Handler)
+        self.server.daemon_threads = True
+        self.server.service_actions = self.pool.close_idle
+
+    def handle_request(self, line):
+        """Handle a single request.
+
+        Arguments:
+            line: Request as a JSON line.
+
+        Returns:
+            The response dictionary.
+        """
+        start = time.perf_counter()
+        op = None
+        try:
+            request = json.loads(line)
+            op = request.pop('op')
+            with profile_stage('serve.' + str(op)):
+                response = {'ok': True, 'result': self.query(op, **request)}
+        except Exception as e:
+            response = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        self.stats.record(str(op), time.perf_counter() - start, response['ok'])
+        return response
+
+    def query(self, op, path=None, name=None, start=None, stop=None,
+              predicate=None, value=None, match='exact'):
+        """Run an operation, see QueryService for the operations.
+
+        Raises:
+            ValueError: Unknown operation.
+
+        Returns:
+            The result of the operation.
+        """
+        if op == 'ping':
+            return 'pong'
+        if op == 'stats':
+            report = self.stats.report()
+            report['handles'] = {'opened': self.pool.opened, 'reused': self.pool.reused}
+            return report
+        if op == 'attributes' and name is None:
+            catalog = load_catalog(path)
+            return {dataset: info['attrs'] for dataset, info in catalog['datasets'].items()}
+        if op == 'attributes':
+            with self.pool.handle(path) as f:
+                return read_attributes(f[name])
+        if op == 'dataset':
+            with self.pool.handle(path) as f:
+                dset = f[name]
+                data = dset[start:stop] if dset.ndim else dset[()]
+            return _json_data(data)
+        if op == 'rdf':
+            return [list(row) for row in search_rdf_index(path, predicate, value, match)]
+        raise ValueError("Unknown operation: " + str(op))
+
+    def serve_forever(self):
+        """Serve requests until interrupted."""
+        print("Serving on", self.address)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
             pass
-    return ontolist
+        finally:
+            self.close()
 
+    def close(self):
+        """Stop the service, close the handles and remove the socket file."""
+        self.server.server_close()
+        self.pool.close()
+        family, bind = _service_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(bind):
+            os.remove(bind)
 
-def query_rdf(rdf_file, predicate):
-    """Query the generated RDF file based on a predicate
-    
-    TODO: Add option to query based on other search terms.
+
+def _service_address(address):
+    """Parse a service address.
 
     Arguments:
-        rdf_file: Path of the RDF file to query.
-        predicate: The entered predicate used to query the RDF.
+        address: Unix socket path or host:port with a loopback host.
+
+    Raises:
+        ValueError: The host is not a loopback address.
+
+    Returns:
+        Tuple of the socket family and the address to bind or connect to.
     """
-    g = Graph().parse(rdf_file, format='turtle')
-    for s,p,o in g:
-        if predicate in p:
-            name = s.split('#')[1]
-            print(p, "======", o)
-            print("Available in file", s.split('#')[1])
-            print()
-    with h5py.File(rdf_file[:-4], 'r') as f:
-        print(f[name][:])
-    
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit() or os.sep in address:
+        return socket.AF_UNIX, address
+    host = host.strip('[]')
+    if host not in LOOPBACK_HOSTS:
+        raise ValueError("The service only listens on localhost, not " + host)
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return family, (host, int(port))
+
+
+def _json_data(data):
+    """Convert dataset content to a JSON value.
 
-def search_naturalis(query):
-    """Query the naturalis specimen collection to add as attributes to an HDF.
-    
     Arguments:
-        query: Search term to retrieve the specimen information.
+        data: Value or numpy.ndarray read from a dataset.
 
     Returns:
-        A dictionary containing information from the naturalis collection.
+        Dictionary with the shape, dtype and data. Byte arrays are
+        encoded as base64, text as strings and numbers as nested lists.
+    """
+    data = np.asarray(data)
+    result = {'shape': list(data.shape), 'dtype': str(data.dtype)}
+    if data.dtype == np.uint8:
+        result['encoding'] = 'base64'
+        result['data'] = base64.b64encode(data.tobytes()).decode('ascii')
+    elif data.dtype.kind in 'OSU':
+        result['data'] = attr_values(data)
+    else:
+        result['data'] = data.tolist()
+    return result
+
+
+class ServiceClient:
+    """Client of a QueryService that keeps its connection open.
+
+    Arguments:
+        address: Unix socket path or localhost:port of the service.
     """
-    naturalis = {}
-    get_specimen = "https://api.biodiversitydata.nl/v2/specimen/find/" + query
-    headers = {
-        'accept': 'application/json',
-        'charset': 'UTF-8',
-    }
-    naturalis_json = requests.get(get_specimen, headers=headers).content
-    jnl = json.loads(naturalis_json)
-    for item in jnl:
-        if item != "sourceSystem" or item != "identifications":
-            naturalis[item] = str(jnl[item])
-        if item == "identifications":
-            for subitem in jnl[item]:
-                for x in range(len(jnl[item])):
-                    for subitem in jnl[item][x]:
-                        naturalis[subitem] = str(jnl[item][x][subitem])
-    return naturalis
+
+    def __init__(self, address):
+        family, connect = _service_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(connect)
+        self.file = self.sock.makefile('rwb')
+
+    def query(self, op, **params):
+        """Send a request, see QueryService.
+
+        Arguments:
+            op: Name of the operation.
+
+        Raises:
+            RuntimeError: The service returned an error.
+
+        Returns:
+            The result of the operation.
+        """
+        params['op'] = op
+        self.file.write(json.dumps(params).encode('utf-8') + b'\n')
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def close(self):
+        """Close the connection."""
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def help():
@@ -608,52 +4067,290 @@ def help():
     print("This script can be used to generate HDF files and convert them to triples.")
     print()
     print("Usage:") 
+    print("Every command can also be given without the leading dashes, i.e. python hdf5generator.py create_hdf <HDF path>")
     print("Create group in HDF file --> python hdf5generator.py --create_group <HDF path>")
     print("Create HDF file --> python hdf5generator.py --create_hdf <HDF path>")
-    print("Get datasets from HDF file --> python hdf5generator.py --get_datasets <HDF path>")
+    print("Create HDF file from a manifest --> python hdf5generator.py --create_hdf <HDF path> --manifest <TSV or JSONL path>")
+    print("Stream text files into compressed byte datasets --> python hdf5generator.py --create_hdf <HDF path> --stream")
+    print("Stream text files with a record index --> python hdf5generator.py --create_hdf <HDF path> --index <line or fasta>")
+    print("Only add new or changed files --> python hdf5generator.py --create_hdf <HDF path> --sync")
+    print("Compare changed files by content --> python hdf5generator.py --create_hdf <HDF path> --sync --checksum")
+    print("Delete datasets whose file is gone --> python hdf5generator.py --create_hdf <HDF path> --sync --prune")
+    print("Store identical files with identical metadata once --> python hdf5generator.py --create_hdf <HDF path> --dedup")
+    print("Create HDF file in parallel --> python hdf5generator.py --create_hdf <HDF path> --workers <number, 0 for all CPUs>")
+    print("Get datasets from HDF file --> python hdf5generator.py --get_datasets <HDF path> [--subtree <group>] [--workers <number>]")
+    print("Store image pyramids for previews --> python hdf5generator.py --create_hdf <HDF path> --pyramid")
+    print("Get image previews from HDF file --> python hdf5generator.py --get_datasets <HDF path> --level <zoom level>")
     print("Get fttributes from HDF file --> python hdf5generator.py --get_attributes <HDF path>")
     print("Delete groups from HDF file --> python hdf5generator.py --delete_groups <HDF path>")
+    print("Profile any command --> python hdf5generator.py <command> <path> --profile")
+    print("Write the profile as JSON --> python hdf5generator.py <command> <path> --profile_json <JSON path>")
+    print("Dump cProfile statistics --> python hdf5generator.py <command> <path> --profile_stats <pstats path>")
+    print("Delete groups matching patterns --> python hdf5generator.py --delete_groups <HDF path> --pattern </Project/*/Assay*> --pattern <...>")
+    print("Show what would be deleted --> python hdf5generator.py --delete_groups <HDF path> --pattern <pattern> --dry_run")
+    print("Give the space of deleted groups back --> python hdf5generator.py --repack <HDF path>")
+    print("Repack with new chunks or compression --> python hdf5generator.py --repack <HDF path> --chunks <rows,columns,...> --compression <gzip, lzf or none> --level <number>")
     print("Create RDF file --> python hdf5generator.py --create_rdf <HDF path>")
-    print("search RDF file --> python hdf5generator.py --search_rdf <HDF path>")
+    print("Stream the triples to a file --> python hdf5generator.py --create_rdf <HDF path> <--ntriples or --nquads> [--gzip]")
+    print("Regenerate the complete RDF file --> python hdf5generator.py --create_rdf <HDF path> --full")
+    print("Create RDF file in parallel --> python hdf5generator.py --create_rdf <HDF path> --workers <number, 0 for all CPUs>")
+    print("Run commands from stdin in one process --> python hdf5generator.py --batch")
+    print("search RDF file --> python hdf5generator.py --search_rdf <RDF path> [--predicate <name>] [--value <value>] [--match <exact, prefix or substring>]")
+    print("Verify the checksums of all datasets --> python hdf5generator.py --verify <HDF path> [--workers <number>]")
+    print("Serve queries from open handles --> python hdf5generator.py --serve <socket path or localhost:port> [--handles <number>]")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) > 2:
-        out_file = sys.argv[2]
-        if sys.argv[1] == "--create_group":
-            input_files = input(
-                "Enter file paths (seperated by a space): "
-            ).replace('\\', '/')
-            in_files = input_files.split(' ')
-            groupname = input("Enter new groupname: ")
-            write_groups(out_file, groupname)
-        elif sys.argv[1] == "--create_hdf":
-            call(["rm " + out_file], shell=True)
-            groups = []
-            input_files = input(
-                "Enter file paths (seperated by a space): "
-            ).replace('\\', '/')
-            input_groups = input(
-                "Enter groups (seperated by a space) i.e. /Project/Investigation/Study/Assay/: ")
-            in_files = input_files.split(' ')
-            groups = input_groups.split(' ')
-            write_func(in_files, out_file, groups)
-        elif sys.argv[1] == "--get_datasets":
-            with h5py.File(out_file, 'r') as f:
-                f.visititems(find_datasets)
-        elif sys.argv[1] == "--get_attributes":
-            get_attr(out_file)
-        elif sys.argv[1] == "--delete_groups":
-            groups_to_delete = generate_groups_to_delete()
-            delete_groups(out_file, groups_to_delete)
-        elif sys.argv[1] == "--create_rdf":
-            generate_rdf(out_file)
-        elif sys.argv[1] == "--search_rdf":
-            predicate = input("Enter predicate to search in RDF: ")
-            query_rdf(out_file, predicate)
+def build_parser():
+    """Build the command line parser with a subcommand per command.
+
+    Returns:
+        The argparse parser.
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--profile', action='store_true')
+    common.add_argument('--profile_json')
+    common.add_argument('--profile_stats')
+    parser = argparse.ArgumentParser(prog='hdf5generator.py', add_help=False)
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('create_group', parents=[common])
+    command.add_argument('path')
+    command.set_defaults(func=command_create_group)
+
+    command = commands.add_parser('create_hdf', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--manifest')
+    command.add_argument('--workers', type=int)
+    command.add_argument('--stream', action='store_true')
+    command.add_argument('--index', choices=['line', 'fasta'])
+    command.add_argument('--dedup', action='store_true')
+    command.add_argument('--sync', action='store_true')
+    command.add_argument('--checksum', action='store_true')
+    command.add_argument('--prune', action='store_true')
+    command.add_argument('--pyramid', action='store_true')
+    command.set_defaults(func=command_create_hdf)
+
+    command = commands.add_parser('get_datasets', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--subtree', default='/')
+    command.add_argument('--workers', type=int)
+    command.add_argument('--level', type=int, default=0)
+    command.set_defaults(func=command_get_datasets)
+
+    command = commands.add_parser('get_attributes', parents=[common])
+    command.add_argument('path')
+    command.set_defaults(func=command_get_attributes)
+
+    command = commands.add_parser('delete_groups', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--pattern', action='append', default=[])
+    command.add_argument('--dry_run', action='store_true')
+    command.set_defaults(func=command_delete_groups)
+
+    command = commands.add_parser('repack', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--chunks')
+    command.add_argument('--compression', choices=['gzip', 'lzf', 'none'])
+    command.add_argument('--level', type=int)
+    command.set_defaults(func=command_repack)
+
+    command = commands.add_parser('create_rdf', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--ntriples', action='store_true')
+    command.add_argument('--nquads', action='store_true')
+    command.add_argument('--gzip', action='store_true')
+    command.add_argument('--full', action='store_true')
+    command.add_argument('--workers', type=int)
+    command.set_defaults(func=command_create_rdf)
+
+    command = commands.add_parser('search_rdf', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--predicate')
+    command.add_argument('--value')
+    command.add_argument('--match', default='substring',
+                         choices=['exact', 'prefix', 'substring'])
+    command.set_defaults(func=command_search_rdf)
+
+    command = commands.add_parser('batch', parents=[common])
+    command.set_defaults(func=command_batch)
+
+    command = commands.add_parser('verify', parents=[common])
+    command.add_argument('path')
+    command.add_argument('--workers', type=int)
+    command.set_defaults(func=command_verify)
+
+    command = commands.add_parser('serve', parents=[common])
+    command.add_argument('address')
+    command.add_argument('--handles', type=int, default=POOL_SIZE)
+    command.set_defaults(func=command_serve)
+    return parser
+
+
+def command_create_group(args):
+    """Create a group with attributes, see write_groups."""
+    input_files = input(
+        "Enter file paths (seperated by a space): "
+    ).replace('\\', '/')
+    in_files = input_files.split(' ')
+    groupname = input("Enter new groupname: ")
+    write_groups(args.path, groupname)
+
+
+def command_create_hdf(args):
+    """Create or update an HDF5 file from a manifest or entered files."""
+    sync = None
+    if args.sync:
+        sync = 'hash' if args.checksum else 'stat'
+    elif os.path.exists(args.path):
+        os.remove(args.path)
+    stream = args.index or args.stream
+    if args.manifest is not None:
+        write_manifest(args.manifest, args.path, workers=args.workers,
+                       stream=stream, dedup=args.dedup, sync=sync,
+                       pyramid=args.pyramid)
+    else:
+        input_files = input(
+            "Enter file paths (seperated by a space): "
+        ).replace('\\', '/')
+        input_groups = input(
+            "Enter groups (seperated by a space) i.e. /Project/Investigation/Study/Assay/: ")
+        in_files = input_files.split(' ')
+        groups = input_groups.split(' ')
+        if args.workers is None:
+            write_func(in_files, args.path, groups, stream=stream,
+                       dedup=args.dedup, sync=sync, pyramid=args.pyramid)
         else:
-            help()
+            write_batch(in_files, args.path, groups,
+                        workers=args.workers or None, stream=stream,
+                        dedup=args.dedup, sync=sync, pyramid=args.pyramid)
+    if args.prune:
+        prune_sources(args.path)
+
+
+def command_get_datasets(args):
+    """Extract the datasets of an HDF5 file, see extract_datasets."""
+    extract_datasets(args.path, subtree=args.subtree,
+                     workers=args.workers or None, level=args.level)
+
+
+def command_get_attributes(args):
+    """Print the attributes of an HDF5 file, see get_attr."""
+    get_attr(args.path)
+
+
+def command_delete_groups(args):
+    """Delete groups by pattern or entered names, see delete_matching.
+    The exit status is 1 when nothing matches.
+    """
+    patterns = args.pattern or generate_groups_to_delete()
+    return 0 if delete_matching(args.path, patterns, dry_run=args.dry_run) else 1
+
+
+def command_repack(args):
+    """Repack an HDF5 file, see repack."""
+    repack(
+        args.path,
+        chunks=None if args.chunks is None else tuple(
+            int(c) for c in args.chunks.split(',')),
+        compression=False if args.compression == 'none' else args.compression,
+        compression_opts=args.level
+    )
+
+
+def command_create_rdf(args):
+    """Create an RDF file, see generate_rdf and export_ntriples."""
+    if args.ntriples or args.nquads:
+        rdf_file = export_ntriples(args.path, quads=args.nquads,
+                                   compress=args.gzip)
+        print(rdf_file, "written")
     else:
-        if sys.argv[1] == "--help":
-            help()
-    
+        generate_rdf(args.path, incremental=not args.full, workers=args.workers)
+
+
+def command_search_rdf(args):
+    """Search an RDF file, see query_rdf."""
+    predicate = args.predicate
+    if predicate is None:
+        predicate = input("Enter predicate to search in RDF: ")
+    query_rdf(args.path, predicate, args.value, args.match)
+
+
+def command_batch(args):
+    """Run command lines read from stdin in this process, so the
+    interpreter, the imported modules and the caches are reused.
+    Every command is followed by a line with BATCH_END and its exit status.
+    Commands that ask for input read it from stdin as well.
+    """
+    for line in sys.stdin:
+        argv = shlex.split(line)
+        if not argv:
+            continue
+        if argv[0] in ['exit', 'quit']:
+            break
+        if argv[0].lstrip('-') == 'batch':
+            status = 2
+        else:
+            try:
+                status = main(argv)
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print("Error:", e)
+                status = 1
+        print(BATCH_END, status)
+        sys.stdout.flush()
+
+
+def command_verify(args):
+    """Verify the checksums of an HDF5 file, see verify.
+    The exit status is 1 when datasets are corrupt or missing.
+    """
+    report = verify(args.path, workers=args.workers or None)
+    return 1 if report['corrupt'] or report['missing'] else 0
+
+
+def command_serve(args):
+    """Run the query service, see QueryService."""
+    service = QueryService(args.address, handles=args.handles)
+    service.serve_forever()
+    print(json.dumps(service.stats.report(), indent=2))
+
+
+def main(argv=None):
+    """Run a command line. The legacy form --command <path> is
+    accepted next to the subcommand form command <path>.
+
+    Keyword Arguments:
+        argv: Command line arguments, None uses sys.argv. (default: {None})
+
+    Returns:
+        The exit status.
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] in ['--help', '-h', 'help']:
+        help()
+        return 0
+    argv[0] = argv[0][2:] if argv[0].startswith('--') else argv[0]
+    if argv[0] not in COMMANDS:
+        help()
+        return 1
+    args = build_parser().parse_args(argv)
+    profile_json = args.profile_json or os.environ.get('HDF5GENERATOR_PROFILE_JSON')
+    profile_stats = args.profile_stats or os.environ.get('HDF5GENERATOR_PROFILE_STATS')
+    # Commands run by a profiled batch are part of the batch profile, only
+    # the main call that started the profiler stops it.
+    started = _profiler is None and bool(
+        args.profile or os.environ.get('HDF5GENERATOR_PROFILE')
+        or profile_json or profile_stats)
+    if started:
+        start_profiling(stats_file=profile_stats)
+    try:
+        status = args.func(args)
+    finally:
+        if started:
+            stop_profiling(json_file=profile_json)
+    return status or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())